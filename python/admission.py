@@ -0,0 +1,153 @@
+"""
+Admission Control
+Bounded concurrency limiter with a short prioritized queue for the /chat endpoint
+"""
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator
+import math
+import threading
+import time
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request cannot be admitted
+
+    Attributes:
+        reason: "queue_full" when the queue is at capacity, "queue_timeout" when the
+            request waited longer than the queue deadline
+        retry_after: Suggested seconds before retrying
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limit how many requests run at once and how many may wait.
+
+    Requests beyond max_concurrent wait in one of two lanes; a freed slot always goes
+    to the oldest high-priority waiter first, then to the oldest normal one. Requests
+    are rejected immediately when the queue is full and after queue_timeout seconds
+    of waiting otherwise.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 16, queue_timeout: float = 5.0):
+        """
+        Args:
+            max_concurrent: Maximum requests processed at the same time
+            max_queue: Maximum requests waiting across both lanes
+            queue_timeout: Maximum seconds a request may wait for a slot
+        """
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._lanes: Dict[str, deque] = {PRIORITY_HIGH: deque(), PRIORITY_NORMAL: deque()}
+        self._wait_times = deque(maxlen=1000)
+        self._avg_service_time = 1.0
+        self._counters = {"admitted": 0, "rejected_queue_full": 0, "rejected_queue_timeout": 0}
+
+    def _queue_depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def _next_waiter(self):
+        for priority in (PRIORITY_HIGH, PRIORITY_NORMAL):
+            if self._lanes[priority]:
+                return self._lanes[priority][0]
+        return None
+
+    def _retry_after(self) -> int:
+        """Estimate of the seconds until the current backlog drains"""
+        backlog = self._queue_depth() + 1
+        return max(1, min(60, math.ceil(self._avg_service_time * backlog / self.max_concurrent)))
+
+    @contextmanager
+    def admit(self, priority: str = PRIORITY_NORMAL) -> Iterator[float]:
+        """
+        Hold a processing slot for the duration of the block
+
+        Args:
+            priority: PRIORITY_HIGH or PRIORITY_NORMAL
+
+        Yields:
+            Seconds the request waited in the queue
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait deadline passed
+        """
+        waited = self._acquire(priority)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self._release(time.monotonic() - started)
+
+    def _acquire(self, priority: str) -> float:
+        with self._cond:
+            if self._active < self.max_concurrent and self._next_waiter() is None:
+                self._active += 1
+                self._counters["admitted"] += 1
+                self._wait_times.append(0.0)
+                return 0.0
+
+            if self._queue_depth() >= self.max_queue:
+                self._counters["rejected_queue_full"] += 1
+                raise AdmissionRejected("queue_full", self._retry_after())
+
+            ticket = object()
+            lane = self._lanes[priority if priority in self._lanes else PRIORITY_NORMAL]
+            lane.append(ticket)
+            enqueued = time.monotonic()
+            deadline = enqueued + self.queue_timeout
+            while True:
+                if self._active < self.max_concurrent and self._next_waiter() is ticket:
+                    lane.popleft()
+                    self._active += 1
+                    waited = time.monotonic() - enqueued
+                    self._counters["admitted"] += 1
+                    self._wait_times.append(waited)
+                    # Another slot may still be free for the next waiter
+                    self._cond.notify_all()
+                    return waited
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    lane.remove(ticket)
+                    self._counters["rejected_queue_timeout"] += 1
+                    self._cond.notify_all()
+                    raise AdmissionRejected("queue_timeout", self._retry_after())
+                self._cond.wait(remaining)
+
+    def _release(self, service_time: float) -> None:
+        with self._cond:
+            self._active -= 1
+            # Exponential moving average used for Retry-After estimates
+            self._avg_service_time = 0.9 * self._avg_service_time + 0.1 * service_time
+            self._cond.notify_all()
+
+    def metrics(self) -> dict:
+        """Snapshot of concurrency, queue depth, wait times and counters"""
+        with self._cond:
+            waits = sorted(self._wait_times)
+            return {
+                "active": self._active,
+                "maxConcurrent": self.max_concurrent,
+                "queueDepth": {priority: len(lane) for priority, lane in self._lanes.items()},
+                "maxQueue": self.max_queue,
+                "waitTimeMs": {
+                    "avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                    "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                    "max": round(waits[-1] * 1000, 1) if waits else 0.0,
+                },
+                "avgServiceTimeMs": round(self._avg_service_time * 1000, 1),
+                **self._counters,
+            }
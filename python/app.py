@@ -1,9 +1,19 @@
 from flask import Flask, request, jsonify
 from flasgger import Swagger
 from rag_agent import RAGAgent
+from index_versions import index_exists
+from corpus_store import corpus_exists
+from local_embeddings import DEFAULT_LOCAL_EMBEDDING_MODEL
+from admission import AdmissionController, AdmissionRejected, PRIORITY_HIGH, PRIORITY_NORMAL
+from refresh_scheduler import read_refresh_status, scheduler_from_env
+from utils import file_lock
+import atexit
 import os
 import sys
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
 app = Flask(__name__)
@@ -13,22 +23,31 @@ swagger = Swagger(app)
 def check_and_setup_data():
     """
     Check if necessary data and database exist.
-    If not, run crawler and vectorize_documents.
+    If not, run crawler and vectorize_documents. Processes starting together (e.g.
+    server workers without a preloading master) wait for each other, so the setup
+    runs once and the others find the data in place.
     """
     data_dir = os.getenv("DATA_PATH", "./data")
     chroma_db_dir = os.getenv("CHROMA_DB_PATH", "./chroma_db")
     
-    data_exists = False
-    if os.path.exists(data_dir):
+    with file_lock(os.path.join(chroma_db_dir, "setup.lock")):
+        setup_missing_data(data_dir, chroma_db_dir)
+
+
+def setup_missing_data(data_dir: str, chroma_db_dir: str) -> None:
+    """Crawl and/or vectorize when the corpus or the index is missing"""
+    data_exists = corpus_exists(os.getenv("CORPUS_PATH", "./corpus.db"))
+    if not data_exists and os.path.exists(data_dir):
         json_files = [f for f in os.listdir(data_dir) if f.endswith('.json')]
         data_exists = len(json_files) > 0
     
-    chroma_db_exists = os.path.exists(chroma_db_dir) and os.path.exists(os.path.join(chroma_db_dir, "chroma.sqlite3"))
+    chroma_db_exists = index_exists(chroma_db_dir)
     
     if not data_exists:
       print("crawling data...")
       result = subprocess.run(
-          [sys.executable, "crawler.py"],
+          # Resume, so a crawl cut short by the timeout continues on the next start
+          [sys.executable, "crawler.py", "--resume"],
           cwd=os.path.dirname(os.path.abspath(__file__)),
           capture_output=True,
           text=True,
@@ -49,29 +68,241 @@ def check_and_setup_data():
       if result.returncode != 0:
           print(f"Error running vectorize_documents.py: {result.stderr}", file=sys.stderr)
 
-print("Checking prerequisites...")
-check_and_setup_data()
-
-print("Initializing RAG Agent...")
-provider = os.getenv("MODEL_PROVIDER", "openai") 
-
-if provider.lower() == "openai":
-    default_embedding = "text-embedding-3-small"
-    default_llm = "gpt-4o-mini"
-else:
-    default_embedding = "nomic-embed-text"
-    default_llm = "llama3.2"
-
-rag_agent = RAGAgent(
-    persist_directory=os.getenv("CHROMA_DB_PATH", "./chroma_db"),
-    collection_name=os.getenv("COLLECTION_NAME", "ioc_data"),
-    embedding_model=os.getenv("EMBEDDING_MODEL", default_embedding),
-    llm_model=os.getenv("LLM_MODEL", default_llm),
-    provider=provider,
-    temperature=float(os.getenv("LLM_TEMPERATURE", "0")),
-    k_results=int(os.getenv("K_RESULTS", "4"))
+
+def create_rag_agent() -> RAGAgent:
+    """
+    Build the RAG agent from environment settings and start its index watcher.
+    Called once per serving process (each pre-forked worker builds its own).
+    """
+    print("Initializing RAG Agent...")
+    provider = os.getenv("MODEL_PROVIDER", "openai") 
+    embedding_provider = os.getenv("EMBEDDING_PROVIDER", provider)
+    
+    if provider.lower() == "openai":
+        default_embedding = "text-embedding-3-small"
+        default_llm = "gpt-4o-mini"
+    else:
+        default_embedding = "nomic-embed-text"
+        default_llm = "llama3.2"
+    
+    if embedding_provider.lower() == "local":
+        default_embedding = DEFAULT_LOCAL_EMBEDDING_MODEL
+    
+    agent = RAGAgent(
+        persist_directory=os.getenv("CHROMA_DB_PATH", "./chroma_db"),
+        collection_name=os.getenv("COLLECTION_NAME", "ioc_data"),
+        embedding_model=os.getenv("EMBEDDING_MODEL", default_embedding),
+        llm_model=os.getenv("LLM_MODEL", default_llm),
+        provider=provider,
+        temperature=float(os.getenv("LLM_TEMPERATURE", "0")),
+        k_results=int(os.getenv("K_RESULTS", "4")),
+        web_search_workers=int(os.getenv("WEB_SEARCH_WORKERS", "4")),
+        max_agent_steps=int(os.getenv("MAX_AGENT_STEPS", "4")),
+        request_timeout=float(os.getenv("AGENT_TIMEOUT", "60")),
+        fast_path=os.getenv("FAST_PATH", "true").lower() == "true",
+        tool_concurrency=int(os.getenv("TOOL_CONCURRENCY", "4")),
+        coalesce_requests=os.getenv("COALESCE_REQUESTS", "true").lower() == "true",
+        embedding_provider=embedding_provider,
+        local_embedding_threads=int(os.getenv("LOCAL_EMBED_THREADS", "0")) or None,
+        local_embedding_backend=os.getenv("LOCAL_EMBED_BACKEND", "torch"),
+        query_batch_size=int(os.getenv("EMBED_MAX_BATCH", "32")),
+        query_batch_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "5")),
+        query_batch_in_flight=int(os.getenv("EMBED_MAX_IN_FLIGHT", "4")),
+        news_window_days=int(os.getenv("NEWS_WINDOW_DAYS", "365")),
+        recency_half_life_days=float(os.getenv("RECENCY_HALF_LIFE_DAYS", "90")),
+        recency_weight=float(os.getenv("RECENCY_WEIGHT", "0.3")),
+        embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+        hnsw_ef_search=int(os.getenv("HNSW_EF_SEARCH", "0")) or None,
+        retrieval_cache_size=int(os.getenv("RETRIEVE_CACHE_SIZE", "1024")),
+        retrieval_cache_ttl=float(os.getenv("RETRIEVE_CACHE_TTL", "300")) or None,
+        faq_match_threshold=float(os.getenv("FAQ_MATCH_THRESHOLD", "0.92"))
+    )
+    print("RAG Agent initialized successfully!")
+    
+    index_reload_interval = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+    if index_reload_interval > 0:
+        agent.start_index_watcher(interval=index_reload_interval)
+    return agent
+
+
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "8")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")),
 )
-print("RAG Agent initialized successfully!")
+PRIORITY_MAX_CHARS = int(os.getenv("ADMISSION_PRIORITY_MAX_CHARS", "300"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", "4"))
+RETRIEVE_MAX_K = int(os.getenv("RETRIEVE_MAX_K", "20"))
+
+
+def server_threads() -> int:
+    """
+    Request threads per serving process. Never fewer than the admission limits need,
+    otherwise overload queues invisibly in the socket backlog instead of being
+    prioritised or rejected by the admission controller; a few more serve /health
+    and /retrieve.
+    """
+    needed = admission.max_concurrent + admission.max_queue + 4
+    return max(int(os.getenv("SERVER_THREADS", "0")), needed)
+
+
+def request_priority(question: str, conversation_history: list) -> str:
+    """Short questions without history go to the high-priority lane."""
+    if not conversation_history and len(question) <= PRIORITY_MAX_CHARS:
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+rag_agent = None
+_rag_agent_lock = threading.Lock()
+_agent_loader = None
+_agent_loader_lock = threading.Lock()
+_load_after_fork = False
+_worker_started_at = datetime.now()
+
+
+def get_rag_agent() -> RAGAgent:
+    """Return this process's RAG agent, creating it on first use."""
+    global rag_agent
+    if rag_agent is None:
+        with _rag_agent_lock:
+            if rag_agent is None:
+                rag_agent = create_rag_agent()
+    return rag_agent
+
+
+def start_rag_agent_load() -> None:
+    """Build this process's RAG agent in a background thread, unless it is built or loading."""
+    global _agent_loader
+    with _agent_loader_lock:
+        if rag_agent is not None or (_agent_loader is not None and _agent_loader.is_alive()):
+            return
+        _agent_loader = threading.Thread(target=_load_rag_agent, name="rag_agent_loader", daemon=True)
+        _agent_loader.start()
+
+
+def _load_rag_agent() -> None:
+    try:
+        get_rag_agent()
+    except Exception as e:
+        print(f"Loading the RAG agent failed: {e}", file=sys.stderr)
+
+
+def parse_conversation(messages: list) -> tuple:
+    """
+    Split a `messages` array into the current question and the previous turns
+
+    Returns:
+        Tuple of (question, list of (question, answer) tuples)
+
+    Raises:
+        ValueError: If there are no messages or the last one has no question
+    """
+    if not messages:
+        raise ValueError("messages field required")
+    
+    current_question = (messages[-1].get("question") or "").strip()
+    if not current_question:
+        raise ValueError("Last message must contain a question")
+    
+    conversation_history = []
+    for msg in messages[:-1]:
+        question = msg.get("question", "")
+        answer = msg.get("answer", "")
+        if question and answer:
+            conversation_history.append((question, answer))
+    return current_question, conversation_history
+
+
+def parse_batch_item(conversation, default_config: dict) -> tuple:
+    """
+    Validate one /chat/batch conversation
+
+    Returns:
+        Tuple of (question, list of (question, answer) tuples, temperature)
+
+    Raises:
+        ValueError: If the conversation, its messages or its modelConfig are malformed
+    """
+    if not isinstance(conversation, dict):
+        raise ValueError("Each conversation must be an object")
+    messages = conversation.get("messages", [])
+    if not isinstance(messages, list) or not all(isinstance(msg, dict) for msg in messages):
+        raise ValueError("messages must be an array of objects")
+    model_config = conversation.get("modelConfig") or default_config
+    if not isinstance(model_config, dict):
+        raise ValueError("modelConfig must be an object")
+    question, conversation_history = parse_conversation(messages)
+    return question, conversation_history, model_config.get("temperature")
+
+
+def answer_admitted(agent: RAGAgent, priority: str, **kwargs) -> tuple:
+    """
+    Answer under admission control. Only the request that computes an answer holds a
+    slot; identical questions coalesced onto it wait without taking one.
+
+    Args:
+        agent: RAG agent
+        priority: Admission lane
+        **kwargs: Arguments of RAGAgent.answer_with_history
+
+    Returns:
+        Tuple of (answer_with_history result, seconds waited for a slot)
+
+    Raises:
+        AdmissionRejected: If no slot could be obtained
+    """
+    queue_waits = []
+
+    @contextmanager
+    def admit():
+        with admission.admit(priority) as waited:
+            queue_waits.append(waited)
+            yield
+
+    result = agent.answer_with_history(admit=admit, **kwargs)
+    return result, (queue_waits[0] if queue_waits else 0.0)
+
+
+def build_chat_response(
+    agent: RAGAgent,
+    question: str,
+    conversation_history: list,
+    result: dict,
+    processing_time: int,
+    queue_wait: float
+) -> dict:
+    """Shape an answer_with_history result as a /chat response body"""
+    answer = result["answer"]
+    prompt_tokens = sum(len(q.split()) + len(a.split()) for q, a in conversation_history) + len(question.split())
+    completion_tokens = len(answer.split())
+    total_tokens = prompt_tokens + completion_tokens
+    
+    return {
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": answer
+                },
+                "finishReason": result["finish_reason"]
+            }
+        ],
+        "sources": result.get("sources", []),
+        "usage": {
+            "promptTokens": prompt_tokens,
+            "completionTokens": completion_tokens,
+            "totalTokens": total_tokens
+        },
+        "metadata": {
+            "modelVersion": getattr(agent.llm, 'model_name', getattr(agent.llm, 'model', 'unknown')),
+            "processingTime": processing_time,
+            "queueWaitTime": int(queue_wait * 1000),
+            "route": result["route"]
+        }
+    }
 
 
 @app.route("/chat", methods=["POST"])
@@ -140,6 +371,23 @@ def chat():
                         type: string
                   finishReason:
                     type: string
+                    description: "stop, timeout/max_steps when the agent budget ran out, or error when the model or tools failed"
+            sources:
+              type: array
+              description: Pages the answer was based on, in retrieval order
+              items:
+                type: object
+                properties:
+                  url:
+                    type: string
+                  title:
+                    type: string
+                  type:
+                    type: string
+                  date:
+                    type: string
+                  fetchedAt:
+                    type: string
             usage:
               type: object
               properties:
@@ -158,6 +406,10 @@ def chat():
           properties:
             error:
               type: string
+      429:
+        description: Admission queue is full; retry after the Retry-After header
+      503:
+        description: Waited too long for a processing slot; retry after the Retry-After header
       500:
         description: Internal server error
         schema:
@@ -173,70 +425,319 @@ def chat():
         messages = data.get("messages", [])
         model_config = data.get("modelConfig", {})
 
-        if not messages:
-            return jsonify({"error": "messages field required"}), 400
+        try:
+            current_question, conversation_history = parse_conversation(messages)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        temperature = model_config.get("temperature")
+        
+        start_time = datetime.now()
+        agent = get_rag_agent()
+        try:
+            result, queue_wait = answer_admitted(
+                agent,
+                request_priority(current_question, conversation_history),
+                question=current_question,
+                conversation_history=conversation_history,
+                temperature=temperature,
+                verbose=False
+            )
+        except AdmissionRejected as e:
+            status = 429 if e.reason == "queue_full" else 503
+            response = jsonify({"error": "Server is overloaded, retry later.", "reason": e.reason})
+            return response, status, {"Retry-After": str(e.retry_after)}
+        processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        return jsonify(build_chat_response(
+            agent, current_question, conversation_history, result, processing_time, queue_wait
+        ))
+    
+    except Exception as e:
+        error_id = f"ERR_{int(datetime.now().timestamp())}"
+        print(f"Error {error_id} in /chat: {str(e)}")
+        return jsonify({"error": "An internal server error occurred.", "errorId": error_id}), 500
+
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    Answer many independent conversations in one request (bulk evaluation, gateway fan-in)
+    ---
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - conversations
+          properties:
+            conversations:
+              type: array
+              description: Conversations in the same format as the /chat body
+              items:
+                type: object
+                properties:
+                  messages:
+                    type: array
+                    items:
+                      type: object
+                  modelConfig:
+                    type: object
+              example:
+                - messages:
+                    - index: 0
+                      question: "Què és l'IOC?"
+                      answer: ""
+                - messages:
+                    - index: 0
+                      question: "Com em puc matricular?"
+                      answer: ""
+            modelConfig:
+              type: object
+              description: Default modelConfig for conversations that do not set one
+            maxParallel:
+              type: integer
+              description: Conversations answered at the same time (capped by BATCH_MAX_PARALLEL)
+    responses:
+      200:
+        description: One result per conversation, in request order
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  index:
+                    type: integer
+                  choices:
+                    type: array
+                    items:
+                      type: object
+                  usage:
+                    type: object
+                  metadata:
+                    type: object
+                  error:
+                    type: string
+                    description: Set instead of choices when this conversation failed
+            metadata:
+              type: object
+      400:
+        description: Bad request
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+      500:
+        description: Internal server error
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Invalid JSON or missing Content-Type header"}), 400
+        conversations = data.get("conversations")
+        if not isinstance(conversations, list) or not conversations:
+            return jsonify({"error": "conversations field required"}), 400
+        if len(conversations) > BATCH_MAX_ITEMS:
+            return jsonify({"error": f"At most {BATCH_MAX_ITEMS} conversations per batch"}), 400
+        default_config = data.get("modelConfig") or {}
+        if not isinstance(default_config, dict):
+            return jsonify({"error": "modelConfig must be an object"}), 400
+        max_parallel = data.get("maxParallel")
+        if max_parallel is None:
+            max_parallel = BATCH_MAX_PARALLEL
+        elif isinstance(max_parallel, bool) or not isinstance(max_parallel, int):
+            return jsonify({"error": "maxParallel must be an integer"}), 400
+        max_parallel = max(1, min(max_parallel, BATCH_MAX_PARALLEL))
         
-        last_message = messages[-1]
-        current_question = last_message.get("question", "").strip()
+        start_time = datetime.now()
+        agent = get_rag_agent()
         
-        if not current_question:
-            return jsonify({"error": "Last message must contain a question"}), 400
+        parsed = []
+        for conversation in conversations:
+            try:
+                parsed.append(parse_batch_item(conversation, default_config))
+            except (ValueError, AttributeError, TypeError) as e:
+                # AttributeError/TypeError: non-string question or answer fields
+                parsed.append(e)
         
-        conversation_history = []
-        for msg in messages[:-1]:
-            question = msg.get("question", "")
-            answer = msg.get("answer", "")
-            if question and answer:
-                conversation_history.append((question, answer))
+        # Embed every question in one provider call instead of one per conversation
+        try:
+            agent.prime_query_embeddings([item[0] for item in parsed if isinstance(item, tuple)])
+        except Exception as e:
+            print(f"Could not pre-embed batch questions: {e}")
         
-        temperature = model_config.get("temperature")
+        def answer_one(index: int) -> dict:
+            item = parsed[index]
+            if not isinstance(item, tuple):
+                return {"index": index, "error": str(item)}
+            question, conversation_history, temperature = item
+            item_start = datetime.now()
+            try:
+                # Each conversation competes for a slot like a normal-priority /chat request
+                result, queue_wait = answer_admitted(
+                    agent,
+                    PRIORITY_NORMAL,
+                    question=question,
+                    conversation_history=conversation_history,
+                    temperature=temperature,
+                    verbose=False
+                )
+            except AdmissionRejected as e:
+                return {"index": index, "error": "Server is overloaded, retry later.", "reason": e.reason}
+            except Exception as e:
+                print(f"Error in /chat/batch item {index}: {str(e)}")
+                return {"index": index, "error": "An internal server error occurred."}
+            processing_time = int((datetime.now() - item_start).total_seconds() * 1000)
+            response = build_chat_response(agent, question, conversation_history, result, processing_time, queue_wait)
+            return {"index": index, **response}
         
-        start_time = datetime.now()
-        answer = rag_agent.query_with_history(
-            question=current_question,
-            conversation_history=conversation_history,
-            temperature=temperature,
-            verbose=False
-        )
-        end_time = datetime.now()
-        processing_time = int((end_time - start_time).total_seconds() * 1000)
+        with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="chat_batch") as executor:
+            results = list(executor.map(answer_one, range(len(conversations))))
+        
+        return jsonify({
+            "results": results,
+            "metadata": {
+                "count": len(results),
+                "errors": sum(1 for r in results if "error" in r),
+                "maxParallel": max_parallel,
+                "processingTime": int((datetime.now() - start_time).total_seconds() * 1000)
+            }
+        })
+    
+    except Exception as e:
+        error_id = f"ERR_{int(datetime.now().timestamp())}"
+        print(f"Error {error_id} in /chat/batch: {str(e)}")
+        return jsonify({"error": "An internal server error occurred.", "errorId": error_id}), 500
+
+
+@app.route("/retrieve", methods=["POST"])
+def retrieve():
+    """
+    Retrieve the most relevant IOC passages for a query (no LLM call)
+    ---
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - query
+          properties:
+            query:
+              type: string
+              example: "Com em puc matricular?"
+            type:
+              type: string
+              enum: [general, noticia]
+              default: general
+            k:
+              type: integer
+              description: Number of passages, a JSON integer from 1 to RETRIEVE_MAX_K (defaults to the agent setting)
+              example: 4
+            mmr:
+              type: boolean
+              description: Diversify results with maximal marginal relevance (defaults to the agent setting; not applied to recency-ranked news)
+    responses:
+      200:
+        description: Retrieved passages, most relevant first
+        schema:
+          type: object
+          properties:
+            passages:
+              type: array
+              items:
+                type: object
+                properties:
+                  content:
+                    type: string
+                  metadata:
+                    type: object
+                  score:
+                    type: number
+            metadata:
+              type: object
+              properties:
+                type:
+                  type: string
+                k:
+                  type: integer
+                mmr:
+                  type: boolean
+                  description: Whether MMR was actually applied
+                cached:
+                  type: boolean
+                processingTime:
+                  type: integer
+      400:
+        description: Bad request
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+      500:
+        description: Internal server error
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Invalid JSON or missing Content-Type header"}), 400
+        query = (data.get("query") or "").strip()
+        if not query:
+            return jsonify({"error": "query field required"}), 400
+        doc_type = data.get("type", "general")
+        if doc_type not in ("general", "noticia"):
+            return jsonify({"error": "type must be 'general' or 'noticia'"}), 400
+        k = data.get("k")
+        if k is not None and (isinstance(k, bool) or not isinstance(k, int)):
+            return jsonify({"error": "k must be an integer"}), 400
+        if k is not None and not 1 <= k <= RETRIEVE_MAX_K:
+            return jsonify({"error": f"k must be between 1 and {RETRIEVE_MAX_K}"}), 400
+        use_mmr = data.get("mmr")
+        if use_mmr is not None and not isinstance(use_mmr, bool):
+            return jsonify({"error": "mmr must be a boolean"}), 400
         
-        prompt_tokens = sum(len(q.split()) + len(a.split()) for q, a in conversation_history) + len(current_question.split())
-        completion_tokens = len(answer.split())
-        total_tokens = prompt_tokens + completion_tokens
+        start_time = datetime.now()
+        agent = get_rag_agent()
+        passages, cached, mmr_applied = agent.retrieve(query, doc_type=doc_type, k=k, use_mmr=use_mmr)
         
         return jsonify({
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": answer
-                    },
-                    "finishReason": "stop"
-                }
-            ],
-            "usage": {
-                "promptTokens": prompt_tokens,
-                "completionTokens": completion_tokens,
-                "totalTokens": total_tokens
-            },
+            "passages": passages,
             "metadata": {
-                "modelVersion": getattr(rag_agent.llm, 'model_name', getattr(rag_agent.llm, 'model', 'unknown')),
-                "processingTime": processing_time
+                "type": doc_type,
+                "k": k or agent.k_results,
+                "mmr": mmr_applied,
+                "cached": cached,
+                "processingTime": int((datetime.now() - start_time).total_seconds() * 1000)
             }
         })
     
     except Exception as e:
         error_id = f"ERR_{int(datetime.now().timestamp())}"
-        print(f"Error {error_id} in /chat: {str(e)}")
+        print(f"Error {error_id} in /retrieve: {str(e)}")
         return jsonify({"error": "An internal server error occurred.", "errorId": error_id}), 500
 
 
 @app.route("/health", methods=["GET"])
 def health():
     """
-    Health check endpoint
+    Health check endpoint (answered by the worker process that received it)
     ---
     responses:
       200:
@@ -250,16 +751,176 @@ def health():
             model:
               type: string
               example: "llama3.2"
+            index:
+              type: string
+              example: "v20251111123456000000"
+            faqAnswers:
+              type: integer
+              description: Pre-computed FAQ answers valid for the live index
+            worker:
+              type: object
+              properties:
+                pid:
+                  type: integer
+                startedAt:
+                  type: string
+            admission:
+              type: object
+              description: Concurrency, queue depth, queue wait times and rejection counters
+            refresh:
+              type: object
+              description: Last scheduled refresh (state, lastStartedAt, lastFinishedAt, lastResult, lastError, nextRunAt, index), null if none ran
             timestamp:
               type: string
+      503:
+        description: This worker has not finished loading the RAG agent yet (the check starts loading it)
     """
+    worker = {
+        "pid": os.getpid(),
+        "startedAt": _worker_started_at.isoformat()
+    }
+    if rag_agent is None:
+        # Workers of an external server may not have been asked to load yet
+        start_rag_agent_load()
+        return jsonify({
+            "status": "starting",
+            "worker": worker,
+            "timestamp": datetime.now().isoformat()
+        }), 503
+    
     return jsonify({
         "status": "healthy",
         "model": getattr(rag_agent.llm, 'model_name', getattr(rag_agent.llm, 'model', 'unknown')),
+        "index": os.path.basename(os.path.normpath(rag_agent.index_path)),
+        "faqAnswers": len(rag_agent.faq_store) if rag_agent.faq_store else 0,
+        "worker": worker,
+        "admission": admission.metrics(),
+        "refresh": read_refresh_status(rag_agent.persist_directory),
         "timestamp": datetime.now().isoformat()
     })
 
 
+def start_refresh_sidecar():
+    """
+    Run the refresh scheduler in a separate process when REFRESH_INTERVAL_HOURS is set;
+    serving processes pick up new versions with their index watchers
+
+    Returns:
+        The sidecar process, or None when refreshes are disabled
+    """
+    if scheduler_from_env() is None:
+        return None
+    return subprocess.Popen(
+        [sys.executable, "refresh_scheduler.py"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def create_app() -> Flask:
+    """
+    Application factory for external WSGI servers, e.g. gunicorn --preload
+    'app:create_app()' or flask --app 'app:create_app()' run. Runs the data
+    prerequisites check and starts the refresh sidecar, as python app.py does;
+    importing app:app directly skips both.
+
+    Processes forked from the calling one (pre-forked workers) start loading their
+    agent right away; otherwise the first health check or request loads it. The
+    sidecar is stopped when the calling process exits; when every worker calls the
+    factory, the sidecars wait on a lock so only one refreshes at a time.
+    """
+    global _load_after_fork
+    print("Checking prerequisites...")
+    check_and_setup_data()
+    if not _load_after_fork:
+        os.register_at_fork(after_in_child=_start_rag_agent_load_after_fork)
+        _load_after_fork = True
+
+    process = start_refresh_sidecar()
+    if process is not None:
+        owner_pid = os.getpid()
+
+        def stop_sidecar():
+            # Forked workers inherit this handler; only the process that started the sidecar stops it
+            if os.getpid() == owner_pid:
+                process.terminate()
+
+        atexit.register(stop_sidecar)
+    return app
+
+
+def _start_rag_agent_load_after_fork() -> None:
+    global _agent_loader, _agent_loader_lock
+    # Threads and locks of the parent do not carry over into the child
+    _agent_loader = None
+    _agent_loader_lock = threading.Lock()
+    start_rag_agent_load()
+
+
+def serve_prefork(workers: int) -> None:
+    """
+    Serve with a pre-fork gunicorn master and `workers` processes, so request handling
+    scales past the GIL. Each worker loads its own Chroma handle and agent after the
+    fork (clients and background threads are not fork-safe); the index files are
+    shared read-only through the OS page cache. Send SIGHUP to the master for a
+    graceful reload of all workers.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class PreforkApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    def post_worker_init(worker):
+        get_rag_agent()
+
+    refresh_process = []
+
+    def when_ready(server):
+        # The master reaps every child, so it cannot wait on the refresh steps itself
+        process = start_refresh_sidecar()
+        if process is not None:
+            refresh_process.append(process)
+
+    def on_exit(server):
+        for process in refresh_process:
+            process.terminate()
+
+    options = {
+        "bind": f"0.0.0.0:{int(os.getenv('PORT', '8080'))}",
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": server_threads(),
+        "timeout": int(os.getenv("SERVER_WORKER_TIMEOUT", "120")),
+        "graceful_timeout": int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "60")),
+        "max_requests": int(os.getenv("SERVER_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "0")),
+        "post_worker_init": post_worker_init,
+        "when_ready": when_ready,
+        "on_exit": on_exit,
+    }
+    PreforkApplication(app, options).run()
+
+
 if __name__ == "__main__":
-    from waitress import serve
-    serve(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    print("Checking prerequisites...")
+    check_and_setup_data()
+    
+    server_workers = int(os.getenv("SERVER_WORKERS", "1"))
+    if server_workers > 1:
+        serve_prefork(server_workers)
+    else:
+        from waitress import serve
+        agent = get_rag_agent()
+        scheduler = scheduler_from_env(on_published=agent.reload_vector_store)
+        if scheduler is not None:
+            scheduler.start()
+        serve(app, host="0.0.0.0", port=int(os.getenv("PORT", "8080")), threads=server_threads())
@@ -0,0 +1,80 @@
+"""
+Batching Embeddings
+Proxy that coalesces concurrent query embeddings into one embed_documents call
+"""
+from collections import OrderedDict
+from typing import List, Optional
+import threading
+from langchain_core.embeddings import Embeddings
+from utils import MicroBatcher
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Wrap an embeddings client so queries embedded concurrently by different request
+    threads are sent as a single batched embed_documents call.
+
+    Queries arriving within max_wait_ms of the first one (up to max_batch_size) share
+    one request to the provider; each waiting thread receives its own vector.
+    Callers that know their queries up front (batch requests) can embed them all in
+    one call with prime(). Document embedding is passed through unchanged.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        timeout: Optional[float] = None,
+        max_primed: int = 1024,
+        max_in_flight: int = 4,
+    ) -> None:
+        """
+        Args:
+            embeddings: Underlying embeddings client (OpenAI, Ollama, local...)
+            max_batch_size: Maximum number of queries per provider call
+            max_wait_ms: Maximum time a query waits for others to join its batch
+            timeout: Maximum time a caller waits for its vector in seconds
+            max_primed: Maximum number of primed query vectors kept in memory
+            max_in_flight: Maximum number of provider calls running at the same time
+        """
+        self.embeddings = embeddings
+        self.timeout = timeout
+        self.max_primed = max_primed
+        self._primed: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._primed_lock = threading.Lock()
+        self._batcher = MicroBatcher(
+            embeddings.embed_documents,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name="query_embed_batcher",
+            max_in_flight=max_in_flight,
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents with the underlying client"""
+        return self.embeddings.embed_documents(texts)
+
+    def prime(self, texts: List[str]) -> None:
+        """
+        Embed known queries in a single call so later embed_query calls for the
+        same texts are answered from memory (oldest primed vectors are evicted first)
+        """
+        with self._primed_lock:
+            missing = list(dict.fromkeys(t for t in texts if t not in self._primed))
+        if not missing:
+            return
+        vectors = self.embeddings.embed_documents(missing)
+        with self._primed_lock:
+            for text, vector in zip(missing, vectors):
+                self._primed[text] = vector
+            while len(self._primed) > self.max_primed:
+                self._primed.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query as part of a micro-batch of concurrent queries"""
+        with self._primed_lock:
+            vector = self._primed.get(text)
+        if vector is not None:
+            return vector
+        return self._batcher.submit(text, timeout=self.timeout)
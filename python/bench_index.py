@@ -0,0 +1,166 @@
+"""
+Vector Index Benchmark
+Measures size, memory, ANN query latency and recall of the published ChromaDB index
+for one or more HNSW ef_search values
+"""
+from dotenv import load_dotenv
+from typing import List, Optional
+import argparse
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import chromadb
+import numpy as np
+from index_versions import resolve_index
+from utils import directory_size
+
+
+load_dotenv()
+
+
+def collection_space(collection) -> str:
+    """Distance function of a collection (l2, cosine or ip)"""
+    try:
+        space = collection.configuration_json["hnsw"]["space"]
+        if space:
+            return space
+    except Exception:
+        pass
+    return (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+def exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int, space: str) -> List[int]:
+    """Brute-force nearest neighbours used as ground truth for recall"""
+    if space == "cosine":
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        distances = 1 - (matrix @ query) / np.where(norms == 0, 1.0, norms)
+    elif space == "ip":
+        distances = -(matrix @ query)
+    else:
+        distances = np.sum((matrix - query) ** 2, axis=1)
+    return list(np.argsort(distances)[:k])
+
+
+def set_ef_search(collection, ef_search: int) -> None:
+    """Change the query-time HNSW ef_search of a collection"""
+    collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+
+
+def bench(
+    persist_directory: str,
+    collection_name: str,
+    num_queries: int = 50,
+    k: int = 4,
+    ef_search_values: Optional[List[int]] = None,
+    seed: int = 42,
+) -> List[dict]:
+    """
+    Benchmark the live index.
+
+    Query vectors are the stored embeddings of randomly sampled chunks, so only the
+    ANN search is timed (no embedding calls). Recall@k is measured against exact
+    brute-force search with the collection's distance function. The index is copied
+    to a temporary directory first, so changing ef_search never touches the
+    published collection.
+
+    Returns:
+        One report dict per ef_search value
+    """
+    index_path, index_collection = resolve_index(persist_directory, collection_name)
+    bench_directory = tempfile.mkdtemp(prefix="bench_index_")
+    try:
+        shutil.copytree(index_path, bench_directory, dirs_exist_ok=True)
+        return _bench_copy(bench_directory, index_path, index_collection, num_queries, k, ef_search_values, seed)
+    finally:
+        shutil.rmtree(bench_directory, ignore_errors=True)
+
+
+def _bench_copy(
+    bench_directory: str,
+    index_path: str,
+    index_collection: str,
+    num_queries: int,
+    k: int,
+    ef_search_values: Optional[List[int]],
+    seed: int,
+) -> List[dict]:
+    """Run the benchmark against a private copy of the index (see bench)"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    client = chromadb.PersistentClient(path=bench_directory)
+    collection = client.get_collection(index_collection)
+    probe = collection.get(limit=1, include=["embeddings"])
+    if probe["ids"]:
+        # Warm the HNSW index into memory before measuring
+        collection.query(query_embeddings=[list(probe["embeddings"][0])], n_results=k)
+    # Measured before the embeddings are fetched for ground truth, so it covers the index only
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    data = collection.get(include=["embeddings"])
+    ids = data["ids"]
+    matrix = np.asarray(data["embeddings"], dtype=np.float32)
+    space = collection_space(collection)
+
+    print(f"Index: {index_path} ({index_collection})")
+    print(f"   - Chunks: {len(ids)}, dimensions: {matrix.shape[1] if len(ids) else 0}, space: {space}")
+    print(f"   - On-disk size: {directory_size(index_path) / 1_048_576:.1f} MiB")
+    print(f"   - Peak RSS growth after loading: {(rss_after - rss_before) / 1024:.1f} MiB")
+
+    if not ids:
+        return []
+
+    rng = random.Random(seed)
+    sample = rng.sample(range(len(ids)), min(num_queries, len(ids)))
+    truth = {i: {ids[j] for j in exact_top_k(matrix, matrix[i], k, space)} for i in sample}
+
+    original_ef = None
+    try:
+        original_ef = collection.configuration_json["hnsw"]["ef_search"]
+    except Exception:
+        pass
+
+    reports = []
+    for ef_search in ef_search_values or [None]:
+        if ef_search:
+            set_ef_search(collection, ef_search)
+        latencies, recalls = [], []
+        for i in sample:
+            start = time.perf_counter()
+            result = collection.query(query_embeddings=[matrix[i].tolist()], n_results=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(truth[i] & set(result["ids"][0])) / k)
+        latencies.sort()
+        reports.append({
+            "ef_search": ef_search or original_ef,
+            "p50_ms": round(latencies[len(latencies) // 2], 2),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+            "recall_at_k": round(sum(recalls) / len(recalls), 3),
+        })
+
+    print(f"\nANN search over {len(sample)} queries (k={k}):")
+    for report in reports:
+        print(
+            f"   - ef_search={report['ef_search']}: p50 {report['p50_ms']} ms, "
+            f"p95 {report['p95_ms']} ms, recall@{k} {report['recall_at_k']}"
+        )
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the published ChromaDB index")
+    parser.add_argument("--persist-directory", default=os.getenv("CHROMA_DB_PATH", "./chroma_db"))
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", "ioc_data"))
+    parser.add_argument("--queries", type=int, default=50, help="Number of sampled query vectors")
+    parser.add_argument("-k", type=int, default=int(os.getenv("K_RESULTS", "4")))
+    parser.add_argument("--ef-search", type=int, nargs="*", help="ef_search values to compare")
+    args = parser.parse_args()
+
+    bench(
+        args.persist_directory,
+        args.collection,
+        num_queries=args.queries,
+        k=args.k,
+        ef_search_values=args.ef_search,
+    )
@@ -0,0 +1,130 @@
+"""
+FAQ Answer Builder
+Generates answers for frequent questions with the current index and LLM, so /chat can
+serve them without an LLM call. Run after vectorize_documents.py.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from typing import List, Optional
+import argparse
+import json
+import os
+from faq_store import save_faq_entries
+from utils import compact_sources, normalize_question
+
+
+load_dotenv()
+
+
+def load_curated_questions(path: str) -> List[str]:
+    """
+    Read a curated question list: plain text with one question per line, or JSONL
+    with a "question" field per line
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            questions.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return questions
+
+
+def mine_frequent_questions(log_path: str, top: int = 100, min_count: int = 3) -> List[str]:
+    """
+    Mine the most frequent questions from a question log (same formats as the
+    curated list); questions are grouped by their normalized text
+
+    Args:
+        log_path: Path to the question log
+        top: Maximum number of questions returned
+        min_count: Minimum occurrences for a question to be kept
+    """
+    counts = Counter()
+    first_seen = {}
+    for question in load_curated_questions(log_path):
+        key = normalize_question(question)
+        counts[key] += 1
+        first_seen.setdefault(key, question)
+    return [first_seen[key] for key, count in counts.most_common(top) if count >= min_count]
+
+
+def build_faq_answers(agent, questions: List[str], workers: int = 4) -> List[dict]:
+    """
+    Answer each question from the general corpus and record its source chunks
+
+    Questions whose retrieval finds nothing, or whose sources lack chunk hashes
+    (indexes built before content-addressed chunks), are skipped.
+
+    Args:
+        agent: RAGAgent bound to the live index
+        questions: Questions to answer
+        workers: Questions answered concurrently
+
+    Returns:
+        FAQ entries ready for save_faq_entries
+    """
+    unique = list({normalize_question(q): q for q in questions}.values())
+
+    def build_entry(question: str) -> Optional[dict]:
+        try:
+            answer, docs = agent.answer_from_partition(question, "general")
+        except Exception as e:
+            print(f"   - Failed: {question!r}: {e}")
+            return None
+        if answer is None:
+            print(f"   - No sources: {question!r}")
+            return None
+        chunk_ids = [doc.metadata.get("chunk_id") for doc in docs]
+        chunk_hashes = [doc.metadata.get("content_hash") for doc in docs]
+        if not all(chunk_ids) or not all(chunk_hashes):
+            print(f"   - Sources without chunk hashes, reindex first: {question!r}")
+            return None
+        return {
+            "question": question,
+            "answer": answer,
+            "source_chunk_ids": chunk_ids,
+            "source_hashes": chunk_hashes,
+            "sources": compact_sources(docs),
+        }
+
+    print(f"Generating answers for {len(unique)} questions...")
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="faq_builder") as executor:
+        entries = [entry for entry in executor.map(build_entry, unique) if entry is not None]
+    print(f"Generated {len(entries)} FAQ answers ({len(unique) - len(entries)} skipped)")
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-compute answers for frequent questions")
+    parser.add_argument("--questions", help="Curated questions (one per line, or JSONL with \"question\")")
+    parser.add_argument("--mine-log", help="Question log to mine the most frequent questions from")
+    parser.add_argument("--top", type=int, default=100, help="Mined questions to keep")
+    parser.add_argument("--min-count", type=int, default=3, help="Minimum occurrences of a mined question")
+    parser.add_argument("--workers", type=int, default=4, help="Questions answered concurrently")
+    args = parser.parse_args()
+
+    if not args.questions and not args.mine_log:
+        parser.error("provide --questions and/or --mine-log")
+
+    questions = []
+    if args.questions:
+        questions += load_curated_questions(args.questions)
+    if args.mine_log:
+        questions += mine_frequent_questions(args.mine_log, top=args.top, min_count=args.min_count)
+
+    # Same configuration as the API, so answers come from the index and LLM it serves
+    os.environ["INDEX_RELOAD_INTERVAL"] = "0"
+    from app import create_rag_agent
+    agent = create_rag_agent()
+
+    entries = build_faq_answers(agent, questions, workers=args.workers)
+    save_faq_entries(
+        agent.persist_directory,
+        entries,
+        index=os.path.relpath(agent.index_path, agent.persist_directory),
+        llm_model=getattr(agent.llm, 'model_name', getattr(agent.llm, 'model', 'unknown')),
+    )
+    print(f"Saved FAQ answers to {agent.persist_directory}")
@@ -0,0 +1,152 @@
+"""
+Chunk identity and deduplication helpers for the vectorizer
+Content-addressed chunk IDs plus exact and MinHash-based near-duplicate detection
+"""
+from array import array
+from typing import Dict, Hashable, List, Optional
+import hashlib
+import re
+
+# Mersenne prime used for the universal hash family of the MinHash permutations
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_content(content: str) -> str:
+    """Collapse whitespace and case so trivially different copies hash the same"""
+    return re.sub(r"\s+", " ", content).strip().casefold()
+
+
+def content_hash(content: str) -> str:
+    """SHA-256 of the normalized chunk content"""
+    return hashlib.sha256(normalize_content(content).encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(source_url: str, chunk_content_hash: str) -> str:
+    """
+    Stable chunk ID derived from the source URL and the content hash, so it does
+    not depend on file order or the position of the chunk in the corpus
+    """
+    url_hash = hashlib.sha256(source_url.encode("utf-8")).hexdigest()
+    return f"{url_hash[:16]}-{chunk_content_hash[:16]}"
+
+
+class ChunkDeduplicator:
+    """
+    Detect exact and near-duplicate chunks across documents.
+
+    Exact duplicates are found by normalized content hash. Near duplicates are found
+    with MinHash signatures over word shingles and LSH banding; a candidate is
+    accepted when the estimated Jaccard similarity reaches the threshold. Chunks are
+    only compared within the same scope (e.g. document type and date), so a news
+    item is never folded into a similar general page or into another edition of
+    the same announcement.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5,
+        threshold: float = 0.9,
+    ):
+        """
+        Args:
+            num_perm: Number of MinHash permutations (must be divisible by bands)
+            bands: Number of LSH bands
+            shingle_size: Words per shingle
+            threshold: Minimum estimated Jaccard similarity to treat chunks as duplicates
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+
+        seed = hashlib.sha256(b"ioc-minhash").digest()
+        self._perms = []
+        for i in range(num_perm):
+            digest = hashlib.sha256(seed + i.to_bytes(4, "little")).digest()
+            a = int.from_bytes(digest[:8], "little") % (_MERSENNE_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:16], "little") % _MERSENNE_PRIME
+            self._perms.append((a, b))
+
+        self._by_hash: Dict[tuple, str] = {}
+        self._signatures: Dict[str, array] = {}
+        self._buckets: List[Dict[tuple, List[str]]] = [{} for _ in range(bands)]
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _signature(self, normalized: str) -> Optional[array]:
+        """MinHash signature of the word shingles, or None for very short chunks"""
+        words = normalized.split(" ")
+        if len(words) < self.shingle_size:
+            return None
+        shingle_hashes = {
+            int.from_bytes(
+                hashlib.blake2b(" ".join(words[i:i + self.shingle_size]).encode("utf-8"), digest_size=4).digest(),
+                "little",
+            )
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+        return array("Q", (
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in shingle_hashes)
+            for a, b in self._perms
+        ))
+
+    def find_duplicate(
+        self,
+        chunk_id: str,
+        content: str,
+        chunk_content_hash: str,
+        scope: Hashable = None,
+    ) -> Optional[str]:
+        """
+        Return the ID of an already registered duplicate of this chunk, or register
+        the chunk as canonical and return None
+
+        Args:
+            chunk_id: ID the chunk would be stored under
+            content: Chunk text
+            chunk_content_hash: Result of content_hash(content)
+            scope: Only chunks registered with an equal scope are duplicates
+        """
+        existing = self._by_hash.get((scope, chunk_content_hash))
+        if existing is not None:
+            self.exact_duplicates += 1
+            return existing
+
+        signature = self._signature(normalize_content(content))
+        if signature is not None:
+            for band in range(self.bands):
+                key = (scope,) + tuple(signature[band * self.rows:(band + 1) * self.rows])
+                for candidate in self._buckets[band].get(key, ()):
+                    candidate_signature = self._signatures[candidate]
+                    matches = sum(1 for x, y in zip(signature, candidate_signature) if x == y)
+                    if matches / self.num_perm >= self.threshold:
+                        self.near_duplicates += 1
+                        self._by_hash[(scope, chunk_content_hash)] = candidate
+                        return candidate
+
+        self._by_hash[(scope, chunk_content_hash)] = chunk_id
+        self._add_signature(chunk_id, signature, scope)
+        return None
+
+    def register(self, chunk_id: str, chunk_content_hash: str, scope: Hashable = None) -> None:
+        """
+        Register an already stored chunk as canonical without counting it, so chunks
+        added to an existing index reuse it when their content is identical. Stored
+        chunks are never near-duplicate candidates: an edited page must replace its
+        old chunk rather than merge into it.
+        """
+        self._by_hash.setdefault((scope, chunk_content_hash), chunk_id)
+
+    def _add_signature(self, chunk_id: str, signature: Optional[array], scope: Hashable) -> None:
+        if signature is None:
+            return
+        self._signatures[chunk_id] = signature
+        for band in range(self.bands):
+            key = (scope,) + tuple(signature[band * self.rows:(band + 1) * self.rows])
+            self._buckets[band].setdefault(key, []).append(chunk_id)
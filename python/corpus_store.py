@@ -0,0 +1,221 @@
+"""
+Corpus Store
+SQLite store of crawled pages keyed by URL, written by the crawler and streamed by the
+vectorizer. The one-JSON-file-per-page layout is kept as an import/export format.
+"""
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+import argparse
+import json
+import os
+import sqlite3
+
+PAGE_FIELDS = ("url", "title", "content", "type", "content_hash", "fetched_at")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    content TEXT NOT NULL,
+    type TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    first_seen_at TEXT NOT NULL,
+    changed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_changed_at ON pages (changed_at);
+CREATE TABLE IF NOT EXISTS page_aliases (
+    alias TEXT PRIMARY KEY,
+    url TEXT NOT NULL
+);
+"""
+
+
+def page_filename(url: str) -> str:
+    """File name of a page in the per-file JSON layout"""
+    return f"{url.replace('/', '_').replace(':', '')}.json"
+
+
+class CorpusStore:
+    """
+    One row per page URL with its content hash and timestamps.
+
+    Re-crawling an unchanged page only refreshes fetched_at; changed_at moves when
+    the content hash changes, so incremental consumers can read changed pages only.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets the vectorizer read while a crawl is writing
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def upsert(self, page: dict) -> bool:
+        """
+        Insert or update a page
+
+        Args:
+            page: Page data with url, title, content, type, content_hash and fetched_at,
+                plus the requested_url it was fetched from when that differs from url
+                (redirect or canonical link)
+
+        Returns:
+            True if the page is new or its content changed
+        """
+        fetched_at = page.get("fetched_at") or datetime.now(timezone.utc).isoformat()
+        with self.conn:
+            requested_url = page.get("requested_url")
+            if requested_url and requested_url != page["url"]:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO page_aliases (alias, url) VALUES (?, ?)",
+                    (requested_url, page["url"]),
+                )
+            row = self.conn.execute(
+                "SELECT content_hash FROM pages WHERE url = ?", (page["url"],)
+            ).fetchone()
+            if row is not None and row["content_hash"] == page["content_hash"]:
+                self.conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (fetched_at, page["url"]))
+                return False
+            self.conn.execute(
+                """
+                INSERT INTO pages (url, title, content, type, content_hash, fetched_at, first_seen_at, changed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    title = excluded.title,
+                    content = excluded.content,
+                    type = excluded.type,
+                    content_hash = excluded.content_hash,
+                    fetched_at = excluded.fetched_at,
+                    changed_at = excluded.changed_at
+                """,
+                (
+                    page["url"], page.get("title"), page["content"], page.get("type", "general"),
+                    page["content_hash"], fetched_at, fetched_at, fetched_at,
+                ),
+            )
+            return True
+
+    def iter_pages(self, changed_since: Optional[str] = None, batch_size: int = 256) -> Iterator[dict]:
+        """
+        Stream pages in URL order without loading the table into memory
+
+        Args:
+            changed_since: Only pages whose content changed at or after this ISO timestamp
+            batch_size: Rows fetched per round trip
+        """
+        query = f"SELECT {', '.join(PAGE_FIELDS)} FROM pages"
+        params = ()
+        if changed_since:
+            query += " WHERE changed_at >= ?"
+            params = (changed_since,)
+        cursor = self.conn.execute(query + " ORDER BY url", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+
+    def stale_urls(self, page_type: str, fetched_before: str) -> List[str]:
+        """URLs of pages of a type last fetched before an ISO timestamp"""
+        rows = self.conn.execute(
+            "SELECT url FROM pages WHERE type = ? AND fetched_at < ? ORDER BY fetched_at",
+            (page_type, fetched_before),
+        )
+        return [row["url"] for row in rows]
+
+    def has_url(self, url: str) -> bool:
+        """Whether a page is stored under url, or was stored after being requested as url"""
+        row = self.conn.execute(
+            "SELECT 1 FROM pages WHERE url = ? UNION ALL SELECT 1 FROM page_aliases WHERE alias = ? LIMIT 1",
+            (url, url),
+        ).fetchone()
+        return row is not None
+
+    def count(self) -> int:
+        """Number of stored pages"""
+        return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def import_json_folder(self, folder: str) -> int:
+        """
+        Load a folder in the per-file JSON layout; files without a recorded URL get
+        one derived from the file name
+
+        Returns:
+            Number of new or changed pages
+        """
+        from chunk_dedup import content_hash
+
+        changed = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if not data.get("content"):
+                    continue
+                data.setdefault("url", entry.name[:-len(".json")])
+                data.setdefault("content_hash", content_hash(data["content"]))
+                if not data.get("fetched_at"):
+                    mtime = os.path.getmtime(entry.path)
+                    data["fetched_at"] = datetime.fromtimestamp(mtime, timezone.utc).isoformat()
+                changed += self.upsert(data)
+        return changed
+
+    def export_json_folder(self, folder: str) -> int:
+        """
+        Write every page as one JSON file in the per-file layout
+
+        Returns:
+            Number of files written
+        """
+        os.makedirs(folder, exist_ok=True)
+        written = 0
+        for page in self.iter_pages():
+            with open(os.path.join(folder, page_filename(page["url"])), "w", encoding="utf-8") as f:
+                json.dump(page, f, ensure_ascii=False, indent=2)
+            written += 1
+        return written
+
+
+def corpus_exists(path: str) -> bool:
+    """Whether a corpus store with at least one page exists at path"""
+    if not os.path.exists(path):
+        return False
+    with CorpusStore(path) as store:
+        return store.count() > 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the crawled corpus")
+    parser.add_argument("command", choices=["import", "export", "stats"])
+    parser.add_argument("folder", nargs="?", default=os.getenv("DATA_PATH", "./data"),
+                        help="Folder in the per-file JSON layout")
+    parser.add_argument("--corpus", default=os.getenv("CORPUS_PATH", "./corpus.db"))
+    args = parser.parse_args()
+
+    with CorpusStore(args.corpus) as store:
+        if args.command == "import":
+            print(f"Imported {store.import_json_folder(args.folder)} new or changed pages from {args.folder}")
+        elif args.command == "export":
+            print(f"Exported {store.export_json_folder(args.folder)} pages to {args.folder}")
+        print(f"Corpus {args.corpus}: {store.count()} pages")
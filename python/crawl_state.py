@@ -0,0 +1,147 @@
+"""
+Crawl State
+Persisted crawl frontier and visited set, so an interrupted crawl can be resumed, with
+per-URL retry counts and exponential backoff for failing pages.
+"""
+from typing import Iterable, Optional, Tuple
+import os
+import sqlite3
+import time
+
+PENDING = "pending"
+VISITED = "visited"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_frontier (
+    url TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    discovered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS crawl_frontier_state ON crawl_frontier (state, next_attempt_at);
+"""
+
+
+class CrawlState:
+    """
+    Frontier (pending URLs) and visited set of a crawl, kept in memory and written
+    to SQLite. Changes are committed at checkpoints, so a crash loses at most the
+    pages processed since the last one.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 3,
+        backoff_base: float = 5.0,
+        backoff_max: float = 300.0,
+    ):
+        """
+        Args:
+            path: SQLite database file (may be shared with the corpus store)
+            max_attempts: Attempts per URL before it is marked failed
+            backoff_base: Delay in seconds before the first retry, doubled on each failure
+            backoff_max: Maximum retry delay in seconds
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+
+        self.pending = {}
+        self.visited = set()
+        for url, state, attempts, next_attempt_at in self.conn.execute(
+            "SELECT url, state, attempts, next_attempt_at FROM crawl_frontier"
+        ):
+            if state == PENDING:
+                self.pending[url] = (attempts, next_attempt_at)
+            elif state == VISITED:
+                self.visited.add(url)
+
+    def __len__(self) -> int:
+        """Number of URLs in the frontier"""
+        return len(self.pending)
+
+    def reset(self) -> None:
+        """Forget the previous crawl and start from an empty frontier"""
+        self.conn.execute("DELETE FROM crawl_frontier")
+        self.conn.commit()
+        self.pending.clear()
+        self.visited.clear()
+
+    def add(self, urls: Iterable[str]) -> int:
+        """
+        Add newly discovered URLs to the frontier (known URLs are ignored)
+
+        Returns:
+            Number of URLs added
+        """
+        now = time.time()
+        new_urls = [url for url in dict.fromkeys(urls) if url not in self.pending and url not in self.visited]
+        for url in new_urls:
+            self.pending[url] = (0, 0.0)
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO crawl_frontier (url, state, discovered_at) VALUES (?, ?, ?)",
+            [(url, PENDING, now) for url in new_urls],
+        )
+        return len(new_urls)
+
+    def next_url(self) -> Tuple[Optional[str], float]:
+        """
+        Pick the next URL that is due
+
+        Returns:
+            Tuple of (url, 0) when one is due, (None, seconds until the earliest retry)
+            when all pending URLs are backing off, or (None, 0) when the frontier is empty
+        """
+        if not self.pending:
+            return None, 0.0
+        now = time.time()
+        url, (_, next_attempt_at) = min(self.pending.items(), key=lambda item: item[1][1])
+        if next_attempt_at <= now:
+            return url, 0.0
+        return None, next_attempt_at - now
+
+    def mark_visited(self, url: str) -> None:
+        self.pending.pop(url, None)
+        self.visited.add(url)
+        self.conn.execute(
+            "UPDATE crawl_frontier SET state = ?, last_error = NULL WHERE url = ?", (VISITED, url)
+        )
+
+    def mark_failed(self, url: str, error: str) -> bool:
+        """
+        Record a failed attempt and schedule a retry with exponential backoff
+
+        Returns:
+            True if the URL will be retried, False if it ran out of attempts
+        """
+        attempts = self.pending.get(url, (0, 0.0))[0] + 1
+        if attempts >= self.max_attempts:
+            self.pending.pop(url, None)
+            self.conn.execute(
+                "UPDATE crawl_frontier SET state = ?, attempts = ?, last_error = ? WHERE url = ?",
+                (FAILED, attempts, error, url),
+            )
+            return False
+        next_attempt_at = time.time() + min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        self.pending[url] = (attempts, next_attempt_at)
+        self.conn.execute(
+            "UPDATE crawl_frontier SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE url = ?",
+            (attempts, next_attempt_at, error, url),
+        )
+        return True
+
+    def checkpoint(self) -> None:
+        """Commit the changes since the last checkpoint"""
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.checkpoint()
+        self.conn.close()
@@ -1,20 +1,85 @@
+import argparse
 import asyncio
+from datetime import datetime, timedelta, timezone
 from playwright.async_api import async_playwright
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urldefrag
 import os
 import json
 from loki_logger import LokiLogger
+from chunk_dedup import content_hash
+from corpus_store import CorpusStore, page_filename
+from crawl_state import CrawlState
 
 BASE_URL = "https://ioc.xtec.cat/educacio/"
 
+# Only the HTML is needed to read h1/#main-box and the links. Same-site stylesheets are
+# kept: inner_text() follows CSS visibility, so without them hidden menus and collapsed
+# elements would leak into the content and change every content_hash
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "texttrack", "manifest"}
+
 class WebCrawler:
-    def __init__(self, start_url):
+    def __init__(
+        self,
+        start_url,
+        corpus_path="./corpus.db",
+        json_dir=None,
+        state_path=None,
+        resume=False,
+        checkpoint_every=10,
+        max_attempts=3,
+        retry_backoff=5.0,
+        news_max_pages=17,
+        news_concurrency=4,
+        block_resources=True,
+        selector_timeout=5000,
+        incremental=False,
+        general_max_age_hours=168,
+        headless=False,
+    ):
+        """
+        Args:
+            start_url: Home page the crawl starts from
+            corpus_path: SQLite corpus store the pages are written to
+            json_dir: Optional folder that also receives one JSON file per page (legacy layout)
+            state_path: SQLite file holding the frontier and visited set (defaults to
+                crawl_state.db next to the corpus; a separate file, so the frontier's open
+                transaction between checkpoints never blocks corpus writes)
+            resume: Continue the previous crawl from its persisted frontier instead of starting over
+            checkpoint_every: Pages processed between commits of the crawl state
+            max_attempts: Attempts per URL before giving up on it
+            retry_backoff: Delay in seconds before the first retry of a failed URL (doubles each time)
+            news_max_pages: Maximum news listing pages walked per crawl
+            news_concurrency: News listing pages fetched at the same time
+            block_resources: Skip images, fonts, media and third-party requests once past the captcha
+            selector_timeout: Milliseconds to wait for the content selector after DOMContentLoaded
+            incremental: Only crawl new news, general pages missing from the corpus and
+                general pages last fetched more than general_max_age_hours ago
+            general_max_age_hours: Age after which an incremental crawl re-fetches a general page
+            headless: Run the browser without a window (a captcha cannot be solved then)
+        """
         self.start_url = start_url
-        self.urls_pool = set()
+        self.corpus_path = corpus_path
+        self.json_dir = json_dir
+        self.corpus = None
+        self.state_path = state_path or os.path.join(os.path.dirname(os.path.abspath(corpus_path)), "crawl_state.db")
+        self.resume = resume
+        self.checkpoint_every = max(1, int(checkpoint_every))
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.news_max_pages = news_max_pages
+        self.news_concurrency = news_concurrency
+        self.block_resources = block_resources
+        self.selector_timeout = selector_timeout
+        self.incremental = incremental
+        self.general_max_age_hours = general_max_age_hours
+        self.headless = headless
+        self.state = None
         self.urls_visited = set()
         self.playwright = None
         self.browser = None
+        self.context = None
         self.page = None
+        self.blocked_requests = 0
         self.logger = LokiLogger()
 
 
@@ -22,10 +87,18 @@ class WebCrawler:
         """ Close browser and playwright instances """
         if self.page:
             await self.page.close()
+        if self.context:
+            await self.context.close()
         if self.browser:
             await self.browser.close()
         if self.playwright:
             await self.playwright.stop()
+        if self.corpus:
+            self.corpus.close()
+            self.corpus = None
+        if self.state:
+            self.state.close()
+            self.state = None
         try:
             self.logger.send_log(
                 message="Browser closed",
@@ -42,8 +115,10 @@ class WebCrawler:
         )
         
         self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch(headless=False)
-        self.page = await self.browser.new_page()
+        self.browser = await self.playwright.chromium.launch(headless=self.headless)
+        # One context for the whole crawl: the captcha cookies and the HTTP cache are shared by every tab
+        self.context = await self.browser.new_context()
+        self.page = await self.context.new_page()
 
         try:
             await self.page.goto(self.start_url)
@@ -71,6 +146,10 @@ class WebCrawler:
                     await self.close()
                     raise RuntimeError(error_msg)
             
+            if self.block_resources:
+                # Installed after the captcha, which needs its scripts and styles
+                await self.context.route("**/*", self.route_request)
+            
         except Exception as e:
             print(f"Error initializing browser: {e}")
             self.logger.send_log(
@@ -80,6 +159,33 @@ class WebCrawler:
             await self.close()
             raise
 
+    async def route_request(self, route):
+        """ Abort requests for resources the text extraction does not need """
+        request = route.request
+        host = urlparse(request.url).hostname or ""
+        site = urlparse(self.start_url).hostname
+        third_party = host != site and not host.endswith("." + site)
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or (third_party and request.resource_type != "document"):
+            self.blocked_requests += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def goto(self, page, url, selector):
+        """
+        Navigate until the DOM is ready, then wait briefly for the selector holding the
+        content instead of waiting for the network to go idle
+
+        Returns:
+            True if the selector appeared
+        """
+        await page.goto(url, wait_until="domcontentloaded")
+        try:
+            await page.wait_for_selector(selector, state="attached", timeout=self.selector_timeout)
+            return True
+        except Exception:
+            return False
+
     async def parse_url(self, link, base_domain):
         """ Parse and normalize URL """
         href = await link.get_attribute('href')
@@ -128,43 +234,102 @@ class WebCrawler:
         
         return unique_urls
     
-    async def get_noticias_urls(self, num=50):
+    def is_known_url(self, url):
+        """ Whether a URL was already crawled, is queued, or is in the corpus store """
+        if url in self.urls_visited or (self.state and url in self.state.pending):
+            return True
+        return bool(self.corpus and self.corpus.has_url(url))
+
+    async def get_noticias_listing(self, page, start, base_domain):
+        """ Fetch one news listing page in the given tab and return the news URLs on it """
+        if not await self.goto(page, f"{self.start_url}?start={start}#news", '.news-text a[href]'):
+            # Past the last listing page
+            return []
+        news_links = await page.query_selector_all('.news-text a[href]')
+        urls = []
+        for link in news_links:
+            url = await self.parse_url(link, base_domain)
+            if url:
+                urls.append(url)
+        return urls
+
+    async def get_noticias_urls(self, max_pages=17, concurrency=4):
+        """
+        Walk the paginated news listing (?start=0,3,6,...), fetching up to
+        `concurrency` listing pages at a time, and return the news URLs not seen before.
+        The walk stops at the first page whose news are all already known (or that
+        is empty), so a daily refresh only touches the first page or two.
+        """
         NUM_PER_PAGE = 3
         noticias_urls = []
+        base_domain = urlparse(self.start_url).netloc
+        concurrency = max(1, min(concurrency, max_pages))
         
         self.logger.send_log(
-            message=f"Starting extraction of noticias URLs (target: {num})",
+            message=f"Starting extraction of noticias URLs (up to {max_pages} pages)",
             labels={"job": "web_crawler", "event": "extract_noticias_urls"}
         )
         
-        for start in range(0, num, NUM_PER_PAGE):
-            noticias_page = f"{self.start_url}?start={start}#news"
-            
-            await self.page.goto(noticias_page)
-            await self.page.wait_for_load_state('networkidle')
-            
-            news_links = await self.page.query_selector_all('.news-text a[href]')
-            base_domain = urlparse(self.start_url).netloc
-            
-            for link in news_links:
-                url = await self.parse_url(link, base_domain)
-                if url and url not in self.urls_visited:
-                    noticias_urls.append(url)
+        pages_fetched = 0
+        done = False
+        # The listing tabs are opened once and reused by every wave
+        tabs = [await self.context.new_page() for _ in range(concurrency)]
+        try:
+            for wave_start in range(0, max_pages, concurrency):
+                starts = [
+                    page_index * NUM_PER_PAGE
+                    for page_index in range(wave_start, min(wave_start + concurrency, max_pages))
+                ]
+                listings = await asyncio.gather(
+                    *(self.get_noticias_listing(tab, start, base_domain) for tab, start in zip(tabs, starts)),
+                    return_exceptions=True,
+                )
+                
+                # Pages are processed in listing order so the early stop is deterministic
+                for start, urls in zip(starts, listings):
+                    if isinstance(urls, Exception):
+                        print(f"Error fetching news listing ?start={start}: {urls}")
+                        continue
+                    pages_fetched += 1
+                    new_urls = [url for url in urls if not self.is_known_url(url)]
+                    noticias_urls.extend(new_urls)
+                    if not new_urls:
+                        done = True
+                        break
+                if done:
+                    break
+        finally:
+            for tab in tabs:
+                await tab.close()
         
+        noticias_urls = list(dict.fromkeys(noticias_urls))
         self.logger.send_log(
-            message=f"Finished extracting noticias URLs, total found: {len(noticias_urls)}",
+            message=f"Finished extracting noticias URLs from {pages_fetched} listing pages, total found: {len(noticias_urls)}",
             labels={"job": "web_crawler", "event": "noticias_extraction_complete"}
         )
         
         return noticias_urls
     
+    async def canonical_url(self, requested_url):
+        """ Canonical URL of the loaded page: rel=canonical if present, else the final URL after redirects """
+        canonical = await self.page.query_selector('link[rel="canonical"]')
+        href = await canonical.get_attribute('href') if canonical else None
+        url = urljoin(self.page.url, href) if href else (self.page.url or requested_url)
+        return urldefrag(url)[0]
+
     async def extract_page_content(self, page):
         self.logger.send_log(
             message=f"Starting content extraction for page: {page}",
             labels={"job": "web_crawler", "event": "page_content_extraction"}
         )
         
-        await self.page.goto(page)
+        await self.goto(self.page, page, '#main-box')
+        try:
+            # Stylesheets must be applied before inner_text() (blocked resources do not delay this)
+            await self.page.wait_for_load_state("load", timeout=self.selector_timeout)
+        except Exception:
+            pass
+        fetched_at = datetime.now(timezone.utc).isoformat()
         title = await self.page.query_selector('h1')
         content = await self.page.query_selector('#main-box')
         
@@ -172,22 +337,35 @@ class WebCrawler:
         content_text = await content.inner_text() if content else "No content"
         
         page_data = {
+            "url": await self.canonical_url(page),
+            # Kept so listing and navbar URLs are recognised as stored under their canonical URL
+            "requested_url": page,
+            "fetched_at": fetched_at,
+            "content_hash": content_hash(content_text),
             "title": title_text,
             "content": content_text,
             "type": "noticia" if "latest-news" in page else "general",
         }
         
-        os.makedirs("data", exist_ok=True)
-        filename = os.path.join("data", f"{page.replace('/', '_').replace(':', '')}.json")
-        
         try:
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(page_data, f, ensure_ascii=False, indent=2)
+            if self.corpus is None:
+                self.corpus = CorpusStore(self.corpus_path)
+            self.corpus.upsert(page_data)
+            
+            if self.json_dir:
+                os.makedirs(self.json_dir, exist_ok=True)
+                filename = os.path.join(self.json_dir, page_filename(page))
+                with open(filename, "w", encoding="utf-8") as f:
+                    json.dump(page_data, f, ensure_ascii=False, indent=2)
         except Exception as e:
             self.logger.send_log(
                 message=f"Error saving content for page: {str(e)}",
                 labels={"job": "web_crawler", "event": "page_content_save_error", "level": "error"}
             )
+            # The caller retries the URL instead of marking it visited
+            raise
+        
+        return page_data
             
     async def crawl(self):
         """
@@ -200,27 +378,53 @@ class WebCrawler:
         )
 
         try:
+            self.state = CrawlState(
+                self.state_path,
+                max_attempts=self.max_attempts,
+                backoff_base=self.retry_backoff,
+            )
+            # A finished crawl leaves no pending URLs: start over from the navbar instead
+            resuming = self.resume and not self.incremental and len(self.state) > 0
+            if not resuming:
+                self.state.reset()
+            self.urls_visited = self.state.visited
+            self.corpus = self.corpus or CorpusStore(self.corpus_path)
+            
             await self.init_browser()
             
-            # Get general URLs from navbar
-            general_urls = await self.get_general_urls()
-            self.urls_pool.update(general_urls)
-            print(f"Found {len(general_urls)} general URLs from navbar:")
+            if resuming:
+                print(f"Resuming crawl: {len(self.state)} URLs pending, {len(self.urls_visited)} already visited")
+            else:
+                # Get general URLs from navbar
+                general_urls = await self.get_general_urls()
+                if self.incremental:
+                    cutoff = datetime.now(timezone.utc) - timedelta(hours=self.general_max_age_hours)
+                    stale_urls = self.corpus.stale_urls("general", cutoff.isoformat())
+                    general_urls = [url for url in general_urls if not self.corpus.has_url(url)] + stale_urls
+                self.state.add(general_urls)
+                print(f"Found {len(general_urls)} general URLs {'to refresh' if self.incremental else 'from navbar'}:")
 
-            noticias_urls = await self.get_noticias_urls()
-            self.urls_pool.update(noticias_urls)
-            print(f"Found {len(noticias_urls)} noticias URLs:")
+                noticias_urls = await self.get_noticias_urls(
+                    max_pages=self.news_max_pages, concurrency=self.news_concurrency
+                )
+                self.state.add(noticias_urls)
+                print(f"Found {len(noticias_urls)} noticias URLs:")
+                self.state.checkpoint()
 
-            total_urls = len(self.urls_pool)
+            total_urls = len(self.state)
             self.logger.send_log(
                 message=f"Starting page crawling process with {total_urls} URLs in pool",
                 labels={"job": "web_crawler", "event": "crawl_loop_start"}
             )
 
             processed_count = 0
-            while self.urls_pool:
-                current_url = self.urls_pool.pop()
-                if current_url in self.urls_visited:
+            while True:
+                current_url, wait = self.state.next_url()
+                if current_url is None:
+                    if not wait:
+                        break
+                    # Only URLs backing off after a failure are left
+                    await asyncio.sleep(wait)
                     continue
                 
                 processed_count += 1
@@ -233,25 +437,33 @@ class WebCrawler:
                 
                 try:
                     await self.extract_page_content(current_url)
-                    self.urls_visited.add(current_url)
                     
                     # Extract new links from the current page
                     page_links = await self.page.query_selector_all('.substudies a[href]')
                     base_domain = urlparse(self.start_url).netloc
                     
+                    new_urls = []
                     for link in page_links:
                         url = await self.parse_url(link, base_domain)
-                        if url and url not in self.urls_visited:
-                            self.urls_pool.add(url)
-                    
+                        # Incremental crawls leave already stored pages to the staleness check
+                        if url and not (self.incremental and self.corpus.has_url(url)):
+                            new_urls.append(url)
+                    total_urls += self.state.add(new_urls)
+                    self.state.mark_visited(current_url)
                     
                 except Exception as e:
-                    print(f"Error crawling {current_url}: {e}")
+                    will_retry = self.state.mark_failed(current_url, str(e))
+                    print(f"Error crawling {current_url}: {e}{' (will retry)' if will_retry else ' (giving up)'}")
                     self.logger.send_log(
                         message=f"Error crawling URL: {str(e)}",
                         labels={"job": "web_crawler", "event": "url_crawl_error", "level": "error"}
                     )
+                
+                if processed_count % self.checkpoint_every == 0:
+                    self.state.checkpoint()
             
+            if self.blocked_requests:
+                print(f"Blocked {self.blocked_requests} non-essential requests")
             self.logger.send_log(
                 message=f"Web crawling session completed successfully. Processed {len(self.urls_visited)} pages",
                 labels={"job": "web_crawler", "event": "crawl_complete"}
@@ -267,8 +479,24 @@ class WebCrawler:
             await self.close()
 
 # Example usage
-async def main():
-    crawler = WebCrawler(BASE_URL)
+async def main(resume=False, incremental=False):
+    crawler = WebCrawler(
+        BASE_URL,
+        corpus_path=os.getenv("CORPUS_PATH", "./corpus.db"),
+        state_path=os.getenv("CRAWL_STATE_PATH") or None,
+        json_dir=os.getenv("DATA_PATH", "./data") if os.getenv("CRAWLER_EXPORT_JSON", "false").lower() == "true" else None,
+        resume=resume,
+        checkpoint_every=int(os.getenv("CRAWL_CHECKPOINT_EVERY", "10")),
+        max_attempts=int(os.getenv("CRAWL_MAX_ATTEMPTS", "3")),
+        retry_backoff=float(os.getenv("CRAWL_RETRY_BACKOFF", "5")),
+        news_max_pages=int(os.getenv("NEWS_MAX_PAGES", "17")),
+        news_concurrency=int(os.getenv("NEWS_PAGE_CONCURRENCY", "4")),
+        block_resources=os.getenv("CRAWL_BLOCK_RESOURCES", "true").lower() == "true",
+        selector_timeout=int(os.getenv("CRAWL_SELECTOR_TIMEOUT_MS", "5000")),
+        incremental=incremental,
+        general_max_age_hours=float(os.getenv("CRAWL_GENERAL_MAX_AGE_HOURS", "168")),
+        headless=os.getenv("CRAWL_HEADLESS", "false").lower() == "true",
+    )
     try:
         await crawler.crawl()
         crawler.logger.send_log(
@@ -285,5 +513,13 @@ async def main():
         raise
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Crawl the IOC portal into the corpus store")
+    parser.add_argument("--resume", action="store_true", help="Continue the previous crawl where it stopped")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only crawl new news and new or stale general pages",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(resume=args.resume, incremental=args.incremental))
     
\ No newline at end of file
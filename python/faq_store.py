@@ -0,0 +1,123 @@
+"""
+Pre-computed FAQ answers
+Answers to frequent questions generated offline (build_faq_answers.py) and served by
+nearest-question lookup; an answer is only served while all of its source chunks are
+unchanged in the live index.
+"""
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import json
+import os
+import numpy as np
+from utils import normalize_question
+
+FAQ_FILE = "faq_answers.json"
+
+
+def faq_path(persist_directory: str) -> str:
+    """Path of the FAQ answer file inside the index root"""
+    return os.path.join(persist_directory, FAQ_FILE)
+
+
+def load_faq_entries(persist_directory: str) -> List[dict]:
+    """Read the stored FAQ entries, or an empty list when there are none"""
+    try:
+        with open(faq_path(persist_directory), "r", encoding="utf-8") as f:
+            return json.load(f).get("entries", [])
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def save_faq_entries(persist_directory: str, entries: List[dict], **info) -> None:
+    """
+    Atomically replace the FAQ answer file
+
+    Args:
+        persist_directory: Index root the answers were generated from
+        entries: FAQ entries (question, answer, source_chunk_ids, source_hashes)
+        **info: Extra build information stored with the entries (e.g. models used)
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    payload = {"generated_at": datetime.now().isoformat(), **info, "entries": entries}
+    tmp_path = faq_path(persist_directory) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, faq_path(persist_directory))
+
+
+def valid_entries(entries: List[dict], vector_store) -> List[dict]:
+    """
+    Keep the entries whose source chunks all still exist in the index with the same
+    content hash; anything re-chunked, edited or removed on reindex drops the answer
+    """
+    chunk_ids = sorted({chunk_id for entry in entries for chunk_id in entry.get("source_chunk_ids", [])})
+    if not chunk_ids:
+        return []
+    stored = vector_store.get(ids=chunk_ids, include=["metadatas"])
+    live_hashes = {
+        chunk_id: (metadata or {}).get("content_hash")
+        for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])
+    }
+    return [
+        entry for entry in entries
+        if entry.get("source_chunk_ids")
+        and all(
+            live_hashes.get(chunk_id) == chunk_hash
+            for chunk_id, chunk_hash in zip(entry["source_chunk_ids"], entry["source_hashes"])
+        )
+    ]
+
+
+class FAQStore:
+    """
+    In-memory nearest-question index over the valid FAQ entries.
+
+    A question matches an entry when its normalized text is identical, or when the
+    cosine similarity of the question embeddings reaches match_threshold.
+    """
+
+    def __init__(self, entries: List[dict], embeddings, match_threshold: float = 0.92):
+        """
+        Args:
+            entries: Valid FAQ entries
+            embeddings: Embeddings client used for the stored and incoming questions
+            match_threshold: Minimum cosine similarity for a nearest-question match
+        """
+        self.entries = entries
+        self.match_threshold = float(match_threshold)
+        self._by_question: Dict[str, dict] = {normalize_question(e["question"]): e for e in entries}
+        self._matrix = None
+        if entries:
+            matrix = np.asarray(embeddings.embed_documents([e["question"] for e in entries]), dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrix = matrix / np.where(norms == 0, 1.0, norms)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(self, question: str, embed_query: Callable[[str], List[float]]) -> Optional[dict]:
+        """
+        Find the FAQ entry answering a question
+
+        Args:
+            question: Incoming question
+            embed_query: Function embedding the question (only called without an exact match)
+
+        Returns:
+            The matching entry, or None
+        """
+        exact = self._by_question.get(normalize_question(question))
+        if exact is not None or self._matrix is None:
+            return exact
+
+        vector = np.asarray(embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        similarities = self._matrix @ (vector / norm)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.match_threshold:
+            return self.entries[best]
+        return None
@@ -0,0 +1,165 @@
+"""
+Versioned vector index directories with an atomically switched alias
+The vectorizer builds every index into a fresh version directory and, once validated,
+points the CURRENT alias at it; readers resolve the alias to find the live index.
+"""
+from datetime import datetime
+from typing import Optional
+import json
+import os
+import shutil
+
+ALIAS_FILE = "CURRENT.json"
+VERSIONS_DIR = "versions"
+LEASES_DIR = "leases"
+
+
+def alias_path(persist_directory: str) -> str:
+    """Path of the alias file inside the index root"""
+    return os.path.join(persist_directory, ALIAS_FILE)
+
+
+def read_alias(persist_directory: str) -> Optional[dict]:
+    """
+    Read the alias of the live index version
+
+    Returns:
+        Dict with "path" (absolute version directory), "collection_name" and
+        build info, or None when the index root has no alias (legacy layout)
+    """
+    try:
+        with open(alias_path(persist_directory), "r", encoding="utf-8") as f:
+            alias = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    alias["path"] = os.path.join(persist_directory, alias["path"])
+    return alias
+
+
+def resolve_index(persist_directory: str, collection_name: str) -> tuple:
+    """
+    Resolve the directory and collection of the live index
+
+    Returns:
+        Tuple of (directory, collection name); falls back to the index root itself
+        when no version has been published yet
+    """
+    alias = read_alias(persist_directory)
+    if alias is None:
+        return persist_directory, collection_name
+    return alias["path"], alias.get("collection_name", collection_name)
+
+
+def index_exists(persist_directory: str) -> bool:
+    """Whether a published version or a legacy single-directory index exists"""
+    alias = read_alias(persist_directory)
+    if alias is not None:
+        return os.path.exists(os.path.join(alias["path"], "chroma.sqlite3"))
+    return os.path.exists(os.path.join(persist_directory, "chroma.sqlite3"))
+
+
+def new_version_directory(persist_directory: str) -> str:
+    """Create and return a fresh, empty version directory"""
+    version = datetime.now().strftime("v%Y%m%d%H%M%S%f")
+    path = os.path.join(persist_directory, VERSIONS_DIR, version)
+    os.makedirs(path, exist_ok=False)
+    return path
+
+
+def publish_version(persist_directory: str, version_directory: str, collection_name: str, **info) -> None:
+    """
+    Atomically point the alias at a validated version directory
+
+    Args:
+        persist_directory: Index root holding the alias and the versions
+        version_directory: Directory of the version to publish
+        collection_name: Collection inside the version
+        **info: Extra build information stored with the alias (e.g. chunk count)
+    """
+    alias = {
+        "path": os.path.relpath(version_directory, persist_directory),
+        "collection_name": collection_name,
+        "published_at": datetime.now().isoformat(),
+        **info,
+    }
+    tmp_path = alias_path(persist_directory) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(alias, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, alias_path(persist_directory))
+
+
+def _lease_path(persist_directory: str, index_path: str) -> Optional[str]:
+    """Lease file of this process for a version directory, or None outside the versions layout"""
+    versions_root = os.path.abspath(os.path.join(persist_directory, VERSIONS_DIR))
+    if os.path.dirname(os.path.abspath(index_path)) != versions_root:
+        return None
+    version = os.path.basename(os.path.normpath(index_path))
+    return os.path.join(persist_directory, LEASES_DIR, f"{version}.{os.getpid()}")
+
+
+def acquire_lease(persist_directory: str, index_path: str) -> None:
+    """Record that this process holds an open handle on a version, so it is not pruned"""
+    path = _lease_path(persist_directory, index_path)
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8"):
+        pass
+
+
+def release_lease(persist_directory: str, index_path: str) -> None:
+    """Drop this process's lease on a version"""
+    path = _lease_path(persist_directory, index_path)
+    if path is not None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def leased_versions(persist_directory: str) -> set:
+    """Versions some live process holds a handle on; leases of dead processes are removed"""
+    leases_root = os.path.join(persist_directory, LEASES_DIR)
+    if not os.path.isdir(leases_root):
+        return set()
+    leased = set()
+    for name in os.listdir(leases_root):
+        version, _, pid = name.rpartition(".")
+        if version and pid.isdigit() and _process_alive(int(pid)):
+            leased.add(version)
+        else:
+            try:
+                os.remove(os.path.join(leases_root, name))
+            except FileNotFoundError:
+                pass
+    return leased
+
+
+def prune_versions(persist_directory: str, keep: int = 2) -> None:
+    """
+    Delete old version directories, keeping the live one, the most recent others and
+    any version a serving process still holds a handle on
+    """
+    versions_root = os.path.join(persist_directory, VERSIONS_DIR)
+    if not os.path.isdir(versions_root):
+        return
+    alias = read_alias(persist_directory)
+    live = os.path.abspath(alias["path"]) if alias else None
+    leased = leased_versions(persist_directory)
+    versions = sorted(os.listdir(versions_root), reverse=True)
+    for version in versions[keep:]:
+        path = os.path.join(versions_root, version)
+        if os.path.abspath(path) != live and version not in leased:
+            shutil.rmtree(path, ignore_errors=True)
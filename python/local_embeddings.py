@@ -0,0 +1,76 @@
+"""
+Local Embeddings
+In-process CPU embedding provider (sentence-transformers, optionally ONNX) so query
+and chunk embeddings need no network round trip.
+"""
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Embeddings computed on CPU inside the current process.
+
+    Embeddings are encoded in batches of batch_size. In the API server, concurrent
+    query embeddings are coalesced by BatchingEmbeddings before reaching the model.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_LOCAL_EMBEDDING_MODEL,
+        num_threads: Optional[int] = None,
+        batch_size: int = 32,
+        backend: str = "torch",
+    ) -> None:
+        """
+        Initialize the local embedding model
+
+        Args:
+            model_name: sentence-transformers model name or local path
+            num_threads: Intra-op CPU threads for inference (None keeps the library default)
+            batch_size: Batch size when embedding documents
+            backend: "torch" or "onnx" (ONNX requires sentence-transformers[onnx])
+        """
+        try:
+            import torch  # type: ignore
+            from sentence_transformers import SentenceTransformer  # type: ignore
+        except ImportError as e:
+            raise ImportError(
+                "Local embeddings require sentence-transformers: pip install sentence-transformers"
+            ) from e
+
+        model_kwargs = None
+        if num_threads:
+            torch.set_num_threads(int(num_threads))
+            if backend == "onnx":
+                # onnxruntime has its own thread pool and ignores the torch setting
+                import onnxruntime  # type: ignore
+
+                session_options = onnxruntime.SessionOptions()
+                session_options.intra_op_num_threads = int(num_threads)
+                model_kwargs = {"session_options": session_options}
+
+        print(f"Loading local embedding model {model_name} on CPU (backend: {backend})...")
+        self.model = SentenceTransformer(model_name, device="cpu", backend=backend, model_kwargs=model_kwargs)
+        self.batch_size = int(batch_size)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """Encode texts into normalized embedding vectors"""
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents"""
+        return self._encode(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self._encode([text])[0]
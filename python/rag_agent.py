@@ -3,18 +3,126 @@ RAG Agent Class
 Creates an agent with tools for querying vectorized documents with conversation history
 and improved retrieval + web search fallbacks.
 """
-from typing import List, Tuple, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import wraps
+from typing import Any, Callable, ContextManager, Dict, List, Tuple, Optional
+import logging
 import os
+import queue
+import re
+import threading
+import time
 from dotenv import load_dotenv
 from langchain.tools import tool
 from langchain.agents import create_agent
 from langchain_chroma import Chroma
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+from langgraph.errors import GraphRecursionError
 from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from utils import LRUCache, SingleFlight, compact_sources, normalize_question
+from local_embeddings import LocalEmbeddings
+from batching_embeddings import BatchingEmbeddings
+from truncated_embeddings import TruncatedEmbeddings
+from index_versions import acquire_lease, release_lease, resolve_index
+from faq_store import FAQStore, faq_path, load_faq_entries, valid_entries
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Keyword/date hints used by the fast-path router (Catalan and Spanish)
+NOTICIA_HINTS = re.compile(
+    r"\b(not[ií]ci\w*|novetat\w*|novedad\w*|anunci\w*|convocat[oò]ri\w*|adjudicaci\w*|"
+    r"termini\w*|plazo\w*|calendari\w*|dates?|fechas?|publicat\w*|publicad\w*|recent\w*|"
+    r"aquest (curs|semestre)|gener|febrer|mar[çc]|abril|maig|juny|juliol|agost|setembre|"
+    r"octubre|novembre|desembre|20\d{2})\b",
+    re.IGNORECASE,
+)
+GENERAL_HINTS = re.compile(
+    r"(\bqu[eèé] (és|es)\b|\bcom (puc|es|em|funciona)\b|\bc[oó]mo\b|\bmatr[ií]cul\w*|"
+    r"\brequisit\w*|\bprocediment\w*|\bprocedimiento\w*|\bguia\b|\bgu[ií]a\b|\bacc[eé]s\b|"
+    r"\bacceso\b|\btitulaci\w*|\bcicles?\b|\bciclos?\b|\bestudis\b|\bestudios\b|"
+    r"\bofereix\w*|\bofrece\w*)",
+    re.IGNORECASE,
+)
+
+
+# Share of the request budget kept for answering from gathered context
+SYNTHESIS_BUDGET_SHARE = 0.25
+
+BUDGET_EXHAUSTED_REPLY = (
+    "No he pogut completar la resposta a temps. Torna-ho a provar d'aquí a una estona."
+)
+
+
+def is_timeout_error(error: BaseException) -> bool:
+    """Whether an exception is a deadline or client timeout (openai, httpx, ollama)."""
+    return isinstance(error, (TimeoutError, FutureTimeoutError)) or "timeout" in type(error).__name__.lower()
+
+
+def release_chroma_client(vector_store: Chroma) -> None:
+    """
+    Stop the client system behind a Chroma handle and drop it from chromadb's per-path
+    system cache, releasing its memory, file handles and SQLite connections.
+    """
+    identifier = getattr(getattr(vector_store, "_client", None), "_identifier", None)
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+    except (ImportError, AttributeError):
+        return
+    if system is not None:
+        system.stop()
+
+
+def timed_tool(func):
+    """
+    Log start, end and duration of each tool call at DEBUG level, so overlapping calls
+    can be verified without printing on every request.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            logger.debug(
+                "Tool %s [%s] start=%.3f end=%.3f took %.0f ms",
+                func.__name__, threading.current_thread().name, start, end, (end - start) * 1000,
+            )
+    return wrapper
+
+
+def rank_by_recency(
+    scored_docs: List[Tuple[Any, float]],
+    k: int,
+    now: float,
+    half_life_days: float,
+    weight: float,
+    with_scores: bool = False,
+) -> List:
+    """
+    Rank (document, relevance) pairs by relevance blended with an exponential recency
+    decay on the document's date_ts metadata; undated documents get no recency credit.
+    Returns the top k documents, or (document, blended score) pairs when with_scores.
+    """
+    ranked = []
+    for doc, relevance in scored_docs:
+        date_ts = doc.metadata.get("date_ts")
+        recency = 0.0
+        if date_ts is not None and half_life_days > 0:
+            age_days = max(0.0, now - float(date_ts)) / 86400
+            recency = 0.5 ** (age_days / half_life_days)
+        ranked.append(((1 - weight) * (relevance or 0.0) + weight * recency, doc))
+    ranked.sort(key=lambda pair: pair[0], reverse=True)
+    if with_scores:
+        return [(doc, score) for score, doc in ranked[:k]]
+    return [doc for _, doc in ranked[:k]]
+
+
 class RAGAgent:
     """
     RAG Agent with conversation history support and database persistence
@@ -33,12 +141,32 @@ class RAGAgent:
         use_mmr: bool = True,
         fetch_k_multiplier: int = 4,
         score_threshold: float = 0.2,
+        web_search_workers: int = 4,
+        max_agent_steps: int = 4,
+        request_timeout: float = 60.0,
+        fast_path: bool = True,
+        tool_concurrency: int = 4,
+        coalesce_requests: bool = True,
+        embedding_provider: Optional[str] = None,
+        local_embedding_threads: Optional[int] = None,
+        local_embedding_backend: str = "torch",
+        query_batch_size: int = 32,
+        query_batch_wait_ms: float = 5.0,
+        query_batch_in_flight: int = 4,
+        news_window_days: int = 365,
+        recency_half_life_days: float = 90.0,
+        recency_weight: float = 0.3,
+        embedding_dimensions: Optional[int] = None,
+        hnsw_ef_search: Optional[int] = None,
+        retrieval_cache_size: int = 1024,
+        retrieval_cache_ttl: Optional[float] = 300.0,
+        faq_match_threshold: float = 0.92,
     ) -> None:
         """
         Initialize RAG Agent
 
         Args:
-            persist_directory: Path to ChromaDB
+            persist_directory: Path to ChromaDB (index root with versioned builds, or a legacy single index)
             collection_name: Name of the ChromaDB collection
             embedding_model: Embedding model name (depends on provider)
             llm_model: LLM model name (depends on provider)
@@ -49,6 +177,26 @@ class RAGAgent:
             use_mmr: Use maximal marginal relevance for retrieval diversification
             fetch_k_multiplier: Over-fetch factor for MMR
             score_threshold: Similarity score cutoff when not using MMR
+            web_search_workers: Size of the pooled web search client threads
+            max_agent_steps: Maximum tool-call iterations per request
+            request_timeout: Wall-clock budget per request in seconds (also used as LLM call timeout)
+            fast_path: Answer clear-cut retrieval questions without the agent loop
+            tool_concurrency: Maximum tool calls of one agent step run in parallel
+            coalesce_requests: Share one computation between identical in-flight questions
+            embedding_provider: "local" for in-process CPU embeddings; defaults to provider
+            local_embedding_threads: CPU threads for local embedding inference
+            local_embedding_backend: "torch" or "onnx" for local embeddings
+            query_batch_size: Max concurrent query embeddings per provider call (1 disables batching)
+            query_batch_wait_ms: Max time a query embedding waits for others to join its batch
+            query_batch_in_flight: Max query embedding calls running at the same time
+            news_window_days: Only search news dated within this many days (0 disables the pre-filter)
+            recency_half_life_days: Age at which a news item's recency boost halves
+            recency_weight: Weight of recency vs. similarity when ranking news (0 disables)
+            embedding_dimensions: Reduce embeddings to this many components (must match the index)
+            hnsw_ef_search: HNSW ef_search applied to the collection at query time
+            retrieval_cache_size: Entries of the retrieve() result cache (0 disables it)
+            retrieval_cache_ttl: Seconds a cached retrieve() result stays valid (None: until evicted)
+            faq_match_threshold: Question similarity needed to serve a pre-computed FAQ answer (0 disables)
         """
 
         self.k_results = k_results
@@ -57,6 +205,23 @@ class RAGAgent:
         self.fetch_k_multiplier = max(2, int(fetch_k_multiplier))
         self.score_threshold = float(score_threshold)
         self.provider = provider.lower()
+        self.embedding_provider = (embedding_provider or provider).lower()
+        self.web_search_workers = int(web_search_workers)
+        self.max_agent_steps = max(1, int(max_agent_steps))
+        self.request_timeout = float(request_timeout)
+        self.fast_path = bool(fast_path)
+        self.tool_concurrency = max(1, int(tool_concurrency))
+        self.coalesce_requests = bool(coalesce_requests)
+        self.news_window_days = max(0, int(news_window_days))
+        self.recency_half_life_days = float(recency_half_life_days)
+        self.recency_weight = min(1.0, max(0.0, float(recency_weight)))
+        self._retrieval_cache = (
+            LRUCache(retrieval_cache_size, retrieval_cache_ttl) if retrieval_cache_size > 0 else None
+        )
+        self.hnsw_ef_search = int(hnsw_ef_search) if hnsw_ef_search else None
+        self._single_flight = SingleFlight()
+        # (llm, agent) pairs for per-request temperature overrides; the shared model is never mutated
+        self._temperature_models = LRUCache(8)
 
         print(f"Initializing RAG Agent with provider {self.provider} and model {llm_model}...")
 
@@ -67,16 +232,19 @@ class RAGAgent:
             if not api_key:
                 raise ValueError("OPENAI_API_KEY not found in environment variables")
             
-            print(f"Using OpenAI with embedding model: {embedding_model}")
-            self.embeddings = OpenAIEmbeddings(
-                model=embedding_model,
-                openai_api_key=api_key,
-            )
+            if self.embedding_provider == "openai":
+                print(f"Using OpenAI with embedding model: {embedding_model}")
+                self.embeddings = OpenAIEmbeddings(
+                    model=embedding_model,
+                    openai_api_key=api_key,
+                    dimensions=embedding_dimensions,
+                )
             
             self.llm = ChatOpenAI(
                 model=llm_model,
                 temperature=temperature,
                 openai_api_key=api_key,
+                timeout=self.request_timeout,
             )
             
         elif self.provider == "ollama":
@@ -90,27 +258,61 @@ class RAGAgent:
 
             print(f"Using Ollama with num_gpu parameter: {num_gpu_param}")
             
-            self.embeddings = OllamaEmbeddings(
-                model=embedding_model,
-                num_gpu=num_gpu_param,
-            )
+            if self.embedding_provider == "ollama":
+                self.embeddings = OllamaEmbeddings(
+                    model=embedding_model,
+                    num_gpu=num_gpu_param,
+                )
             
             self.llm = ChatOllama(
                 model=llm_model,
                 temperature=temperature,
                 num_gpu=num_gpu_param,
                 num_ctx=num_ctx,
+                client_kwargs={"timeout": self.request_timeout},
             )
         else:
             raise ValueError(f"Unsupported provider: {self.provider}. Choose 'ollama' or 'openai'")
 
-        # Load vector store
-        print(f"Loading vector store from {persist_directory}...")
-        self.vector_store = Chroma(
-            collection_name=collection_name,
-            embedding_function=self.embeddings,
-            persist_directory=persist_directory,
-        )
+        if self.embedding_provider == "local":
+            print(f"Using local CPU embeddings with model: {embedding_model}")
+            self.embeddings = LocalEmbeddings(
+                model_name=embedding_model,
+                num_threads=local_embedding_threads,
+                backend=local_embedding_backend,
+            )
+        elif self.embedding_provider != self.provider:
+            raise ValueError(
+                f"Unsupported embedding provider: {self.embedding_provider}. "
+                f"Choose 'local' or the model provider '{self.provider}'"
+            )
+
+        if embedding_dimensions and not isinstance(self.embeddings, OpenAIEmbeddings):
+            self.embeddings = TruncatedEmbeddings(self.embeddings, embedding_dimensions)
+
+        if query_batch_size > 1:
+            # Concurrent requests share one embedding call for their queries
+            self.embeddings = BatchingEmbeddings(
+                self.embeddings,
+                max_batch_size=query_batch_size,
+                max_wait_ms=query_batch_wait_ms,
+                max_in_flight=query_batch_in_flight,
+                timeout=self.request_timeout,
+            )
+
+        # Load vector store (resolving the published index version, if any)
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self._index_lock = threading.Lock()
+        self.index_path, index_collection = resolve_index(persist_directory, collection_name)
+        print(f"Loading vector store from {self.index_path}...")
+        self.vector_store = self._open_vector_store(self.index_path, index_collection)
+
+        # Pre-computed answers for frequent questions (see build_faq_answers.py)
+        self.faq_match_threshold = float(faq_match_threshold)
+        self.faq_store: Optional[FAQStore] = None
+        self._faq_mtime: Optional[float] = None
+        self.reload_faq_store(force=True)
 
         # Create tools
         self._create_retrieval_general_tool()
@@ -121,18 +323,124 @@ class RAGAgent:
         # Try to create agent with tools, fallback to simple RAG if not supported
         self._initialize_agent()
 
+    # ---------------------------- Index reload -----------------------------
+    def _open_vector_store(self, index_path: str, collection_name: str) -> Chroma:
+        """Open a Chroma index and apply the query-time HNSW ef_search, if configured."""
+        # Leased before opening, so the vectorizer does not prune the version under us
+        acquire_lease(self.persist_directory, index_path)
+        vector_store = Chroma(
+            collection_name=collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=index_path,
+        )
+        if self.hnsw_ef_search:
+            try:
+                vector_store._collection.modify(configuration={"hnsw": {"ef_search": self.hnsw_ef_search}})
+            except Exception as e:
+                print(f"Could not set HNSW ef_search={self.hnsw_ef_search}: {e}")
+        return vector_store
+
+    def reload_vector_store(self) -> bool:
+        """
+        Switch to the currently published index version if it changed.
+
+        The new Chroma handle is opened before the swap, and requests already running
+        keep using the handle they read, so nothing in flight is dropped. The previous
+        handle is closed, and its version lease released, after a grace period of
+        twice the request timeout.
+
+        Returns:
+            True if a new index version was loaded
+        """
+        with self._index_lock:
+            index_path, index_collection = resolve_index(self.persist_directory, self.collection_name)
+            if index_path == self.index_path:
+                return False
+            print(f"Hot-reloading vector store from {index_path}...")
+            previous_store, previous_path = self.vector_store, self.index_path
+            self.vector_store = self._open_vector_store(index_path, index_collection)
+            self.index_path = index_path
+        self._retire_vector_store(previous_store, previous_path)
+        # Chunks may have changed, so FAQ answers are validated again
+        self.reload_faq_store(force=True)
+        return True
+
+    def _retire_vector_store(self, vector_store: Chroma, index_path: str) -> None:
+        """Close a replaced handle once the requests that may still use it have finished."""
+        def retire():
+            with self._index_lock:
+                # Chroma caches one client per path, so a version switched back to stays open
+                if index_path == self.index_path:
+                    return
+                try:
+                    release_chroma_client(vector_store)
+                except Exception as e:
+                    print(f"Could not close index {index_path}: {e}")
+                release_lease(self.persist_directory, index_path)
+
+        timer = threading.Timer(2 * self.request_timeout, retire)
+        timer.daemon = True
+        timer.start()
+
+    def reload_faq_store(self, force: bool = False) -> bool:
+        """
+        Load the pre-computed FAQ answers that are still valid for the live index.
+
+        Args:
+            force: Reload even if the FAQ file did not change (e.g. after an index switch)
+
+        Returns:
+            True if the FAQ store was (re)loaded
+        """
+        if self.faq_match_threshold <= 0:
+            return False
+        try:
+            mtime = os.path.getmtime(faq_path(self.persist_directory))
+        except OSError:
+            mtime = None
+        if not force and mtime == self._faq_mtime:
+            return False
+
+        entries = load_faq_entries(self.persist_directory) if mtime is not None else []
+        valid = valid_entries(entries, self.vector_store) if entries else []
+        self.faq_store = FAQStore(valid, self.embeddings, self.faq_match_threshold) if valid else None
+        self._faq_mtime = mtime
+        if entries:
+            print(f"Loaded {len(valid)} FAQ answers ({len(entries) - len(valid)} invalidated by index changes)")
+        return True
+
+    def start_index_watcher(self, interval: float = 30.0) -> threading.Thread:
+        """
+        Poll the index alias in a daemon thread and hot-reload when a new version is
+        published; a rebuilt FAQ answer file is picked up the same way.
+        """
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    if not self.reload_vector_store():
+                        self.reload_faq_store()
+                except Exception as e:
+                    print(f"Index reload failed, keeping current index: {e}")
+
+        watcher = threading.Thread(target=watch, name="index_watcher", daemon=True)
+        watcher.start()
+        return watcher
+
     # ------------------------------ Tools ---------------------------------
     def _create_retrieval_general_tool(self) -> None:
         """Create the retrieval tool for general IOC docs with MMR option."""
-        vector_store = self.vector_store
         k = self.k_results
         use_mmr = self.use_mmr
         fetch_k = max(k * self.fetch_k_multiplier, 20)
         score_threshold = self.score_threshold
 
         @tool(response_format="content_and_artifact")
+        @timed_tool
         def retrieve_general_context(query: str):
             """Retrieve IOC general docs (guides, procedures, FAQs, reference)."""
+            # Read the handle once per call so a hot reload never affects an in-flight search
+            vector_store = self.vector_store
             try:
                 if use_mmr:
                     retrieved_docs = vector_store.max_marginal_relevance_search(
@@ -166,17 +474,21 @@ class RAGAgent:
 
     def _create_retrieval_noticia_tool(self) -> None:
         """Create the retrieval tool for IOC news/announcements with MMR option."""
-        vector_store = self.vector_store
         k = self.k_results
         use_mmr = self.use_mmr
         fetch_k = max(k * self.fetch_k_multiplier, 20)
         score_threshold = self.score_threshold
 
         @tool(response_format="content_and_artifact")
+        @timed_tool
         def retrieve_noticia_context(query: str):
             """Retrieve IOC news/announcements (dates, recent changes)."""
+            # Read the handle once per call so a hot reload never affects an in-flight search
+            vector_store = self.vector_store
             try:
-                if use_mmr:
+                if self.news_window_days > 0 or self.recency_weight > 0:
+                    retrieved_docs = self._search_recent_news(vector_store, query, k, fetch_k)
+                elif use_mmr:
                     retrieved_docs = vector_store.max_marginal_relevance_search(
                         query,
                         k=k,
@@ -204,6 +516,107 @@ class RAGAgent:
 
         self.retrieve_noticia_context = retrieve_noticia_context
 
+    def _search_recent_news(
+        self, vector_store: Chroma, query: str, k: int, fetch_k: int, with_scores: bool = False
+    ) -> List:
+        """
+        Search news restricted to the recent date window and rank by relevance blended
+        with recency. Falls back to all news when the window holds fewer than k chunks
+        (e.g. an index built before dates were normalized).
+        """
+        now = time.time()
+        news_filter = {"type": "noticia"}
+        candidates = []
+        if self.news_window_days > 0:
+            cutoff = int(now - self.news_window_days * 86400)
+            candidates = vector_store.similarity_search_with_relevance_scores(
+                query,
+                k=fetch_k,
+                filter={"$and": [news_filter, {"date_ts": {"$gte": cutoff}}]},
+            )
+        if len(candidates) < k:
+            candidates = vector_store.similarity_search_with_relevance_scores(
+                query, k=fetch_k, filter=news_filter
+            )
+        return rank_by_recency(
+            candidates, k, now, self.recency_half_life_days, self.recency_weight, with_scores=with_scores
+        )
+
+    def retrieve(
+        self,
+        query: str,
+        doc_type: str = "general",
+        k: Optional[int] = None,
+        use_mmr: Optional[bool] = None,
+    ) -> Tuple[List[Dict[str, Any]], bool, bool]:
+        """
+        Retrieve passages without involving the LLM, with the same strategy as the
+        retrieval tools. Results are cached per index version, type, k, applied MMR
+        setting and normalized query.
+
+        Args:
+            query: Search text
+            doc_type: "general" or "noticia"
+            k: Number of passages (defaults to k_results)
+            use_mmr: Diversify results with MMR (defaults to the agent setting; news
+                ranked by recency never use MMR)
+
+        Returns:
+            Tuple of (passages, cached, MMR applied). Each passage is a dict with
+            "content", "metadata" and "score" (relevance, higher is better;
+            recency-blended for news)
+
+        Raises:
+            ValueError: If doc_type is not "general" or "noticia"
+        """
+        if doc_type not in ("general", "noticia"):
+            raise ValueError(f"Unsupported type: {doc_type}. Choose 'general' or 'noticia'")
+        k = k or self.k_results
+        use_mmr = self.use_mmr if use_mmr is None else bool(use_mmr)
+        recency_ranked = doc_type == "noticia" and (self.news_window_days > 0 or self.recency_weight > 0)
+        if recency_ranked:
+            use_mmr = False
+        vector_store = self.vector_store
+
+        key = (self.index_path, doc_type, k, use_mmr, normalize_question(query))
+        if self._retrieval_cache is not None:
+            passages = self._retrieval_cache.get(key)
+            if passages is not None:
+                return passages, True, use_mmr
+
+        fetch_k = max(k * self.fetch_k_multiplier, 20)
+        type_filter = {"type": doc_type}
+        if recency_ranked:
+            scored_docs = self._search_recent_news(vector_store, query, k, fetch_k, with_scores=True)
+        elif use_mmr:
+            # One query embedding serves both the scored candidates and the MMR selection
+            embedding = self.embeddings.embed_query(query)
+            relevance_fn = vector_store._select_relevance_score_fn()
+            candidates = vector_store.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=fetch_k, filter=type_filter
+            )
+            scores = {doc.id: relevance_fn(distance) for doc, distance in candidates}
+            selected = vector_store.max_marginal_relevance_search_by_vector(
+                embedding, k=k, fetch_k=fetch_k, filter=type_filter
+            )
+            scored_docs = [(doc, scores.get(doc.id)) for doc in selected]
+        else:
+            scored_docs = vector_store.similarity_search_with_relevance_scores(
+                query, k=k, filter=type_filter
+            )
+
+        passages = [
+            {
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "score": round(float(score), 4) if score is not None else None,
+            }
+            for doc, score in scored_docs
+        ]
+        if self._retrieval_cache is not None:
+            self._retrieval_cache.put(key, passages)
+        return passages, False, use_mmr
+
     def _create_history_tool(self) -> None:
         """Create a placeholder history tool (not used with external history management)."""
         @tool
@@ -214,28 +627,61 @@ class RAGAgent:
         self.get_user_history = get_user_history
 
     def _create_web_search_tool(self) -> None:
-        """Create the web search tool using DuckDuckGo with site-restricted first."""
+        """
+        Create the web search tool using DuckDuckGo with site-restricted first.
+
+        The search client is built once per worker thread of a dedicated pool, so
+        every call reuses a keep-alive HTTP session instead of opening a new one.
+        The site-restricted and open-web queries run concurrently; the open-web
+        result is only used when the site-restricted search returns nothing.
+        """
+        num_results = 5
+        executor = ThreadPoolExecutor(
+            max_workers=max(2, self.web_search_workers),
+            thread_name_prefix="web_search",
+        )
+        local = threading.local()
+
+        try:
+            from duckduckgo_search import DDGS  # type: ignore
+
+            def run_search(search_query: str) -> str:
+                client = getattr(local, "client", None)
+                if client is None:
+                    client = DDGS()
+                    local.client = client
+                results = client.text(search_query, max_results=num_results) or []
+                return ", ".join(
+                    f"snippet: {r.get('body', '')}, title: {r.get('title', '')}, link: {r.get('href', '')}"
+                    for r in results
+                )
+        except ImportError:
+            from langchain_community.tools import DuckDuckGoSearchResults  # type: ignore
+
+            search = DuckDuckGoSearchResults(num_results=num_results)
+
+            def run_search(search_query: str) -> str:
+                return search.run(search_query)
 
         @tool
+        @timed_tool
         def web_search(query: str):
             """Search the web for IOC info. Prefer site:ioc.xtec.cat; fallback open web."""
             try:
+                site_future = executor.submit(run_search, f"site:ioc.xtec.cat {query}")
+                open_future = executor.submit(run_search, query)
                 try:
-                    from langchain_community.tools import DuckDuckGoSearchResults  # type: ignore
-
-                    search = DuckDuckGoSearchResults(num_results=5)
-                    results = search.run(f"site:ioc.xtec.cat {query}")
-                    if not results:
-                        results = search.run(query)
-                    return results
+                    results = site_future.result()
                 except Exception:
-                    from langchain_community.tools import DuckDuckGoSearchRun  # type: ignore
-
-                    search = DuckDuckGoSearchRun()
-                    return search.run(f"site:ioc.xtec.cat {query}") or search.run(query)
+                    results = ""
+                if results:
+                    open_future.cancel()
+                    return results
+                return open_future.result()
             except Exception as e:
                 return f"Web search failed: {str(e)}"
 
+        self._web_search_executor = executor
         self.web_search = web_search
 
     # --------------------------- Agent wiring ------------------------------
@@ -249,89 +695,357 @@ class RAGAgent:
             self.web_search,
         ]
 
-        system_prompt = (
+        self.system_prompt = (
             "Ets un assistent expert de l'Institut Obert de Catalunya (IOC). "
             "IMPORTANT: Respon SEMPRE a la pregunta més recent de l'usuari. "
             "Tria eines segons el context: si és procediment o guia, usa retrieve_general_context; "
             "si és canvi/novetat/‘notícia’ o hi ha dates recents, usa retrieve_noticia_context. "
             "Si la recuperació és buida o poc rellevant, usa web_search. "
+            "Si necessites més d'una eina, demana-les totes en el mateix pas. "
             "Respon sempre en l'idioma de la pregunta."
         )
 
         try:
-            self.agent = create_agent(self.llm, self.tools, system_prompt=system_prompt)
+            self.agent = create_agent(self.llm, self.tools, system_prompt=self.system_prompt)
             self.use_agent = True
             print("Using agent mode with tool calling")
         except NotImplementedError:
             print("Agent mode not supported, langchain version may be outdated.")
             self.use_agent = False
 
+    def _models_for(self, temperature: Optional[float]) -> Tuple[Any, Any]:
+        """
+        Chat model and agent graph answering one request.
+
+        A temperature override gets its own model copy and compiled agent (cached per
+        value), so concurrent requests never change each other's temperature.
+
+        Returns:
+            Tuple of (llm, agent)
+        """
+        agent = getattr(self, "agent", None)
+        if temperature is None or float(temperature) == self.llm.temperature:
+            return self.llm, agent
+        temperature = float(temperature)
+        models = self._temperature_models.get(temperature)
+        if models is None:
+            llm = self.llm.model_copy(update={"temperature": temperature})
+            if self.use_agent:
+                agent = create_agent(llm, self.tools, system_prompt=self.system_prompt)
+            models = (llm, agent)
+            self._temperature_models.put(temperature, models)
+        return models
+
+    # --------------------------- Fast-path router ---------------------------
+    def _route_question(
+        self,
+        question: str,
+        conversation_history: Optional[List[Tuple[str, str]]] = None,
+    ) -> Optional[str]:
+        """
+        Cheap keyword/date heuristic deciding whether a question clearly maps to one
+        retrieval partition.
+
+        Returns:
+            "general" or "noticia" when the question unambiguously targets that
+            document type, None when the full agent should handle it (follow-up
+            questions with history, mixed or unknown intent).
+        """
+        if not self.fast_path or conversation_history:
+            return None
+
+        is_noticia = bool(NOTICIA_HINTS.search(question))
+        is_general = bool(GENERAL_HINTS.search(question))
+        if is_noticia == is_general:
+            return None
+        return "noticia" if is_noticia else "general"
+
+    def answer_from_partition(
+        self, question: str, doc_type: str, llm: Optional[Any] = None
+    ) -> Tuple[Optional[str], List]:
+        """
+        Retrieve directly from one partition and answer with a single LLM call.
+
+        Args:
+            question: The question to answer
+            doc_type: "general" or "noticia"
+            llm: Chat model to answer with (defaults to the shared model)
+
+        Returns:
+            Tuple of (response text, retrieved documents). The text is None when
+            retrieval found nothing and the agent (which may fall back to web search)
+            should take over.
+        """
+        retrieval_tool = (
+            self.retrieve_noticia_context if doc_type == "noticia" else self.retrieve_general_context
+        )
+        serialized, retrieved_docs = retrieval_tool.func(question)
+        if not retrieved_docs:
+            return None, []
+
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            HumanMessage(content=f"Context:\n{serialized}\n\nQuestion: {question}\n\nAnswer:"),
+        ]
+        return (llm or self.llm).invoke(messages).content, retrieved_docs
+
+    def _match_faq(self, question: str) -> Optional[dict]:
+        """Pre-computed FAQ entry answering a frequent question, or None."""
+        faq_store = self.faq_store
+        if faq_store is None:
+            return None
+        return faq_store.match(question, self.embeddings.embed_query)
+
     # ---------------------------- Query path -------------------------------
-    def query(self, question: str, verbose: bool = True) -> str:
+    def _answer_from_gathered_context(self, question: str, gathered: List, llm: Optional[Any] = None) -> str:
+        """Answer with one LLM call using the tool results the agent already collected."""
+        context_blob = "\n\n".join(
+            str(m.content) for m in gathered if isinstance(m, ToolMessage) and m.content
+        )
+        prompt = f"Context:\n{context_blob}\n\nQuestion: {question}\n\nAnswer:"
+        return (llm or self.llm).invoke(prompt).content
+
+    @staticmethod
+    def _gathered_documents(gathered: List) -> List:
+        """Retrieved documents carried as artifacts by the agent's tool messages."""
+        docs = []
+        for message in gathered:
+            if isinstance(message, ToolMessage) and isinstance(message.artifact, list):
+                docs.extend(message.artifact)
+        return docs
+
+    @staticmethod
+    def _run_until(deadline: float, fn: Callable[[], Any]) -> Any:
         """
-        Query the agent without history (for simple CLI usage).
-        For web API with history, use query_with_history instead.
+        Run fn in a daemon thread and wait for it until the deadline. An abandoned call
+        finishes in the background (bounded by the client timeout) without holding up
+        the request.
+
+        Raises:
+            TimeoutError: If the deadline passed first
         """
-        messages = [HumanMessage(content=question)]
+        future = Future()
+
+        def target():
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=target, name="agent_call", daemon=True).start()
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            raise TimeoutError("Request deadline exceeded") from None
+
+    def _stream_until(self, deadline: float, messages: List, config: dict, agent: Optional[Any] = None):
+        """
+        Stream the agent graph states from a daemon thread, raising TimeoutError as soon
+        as the deadline passes, even in the middle of a model or tool call. The
+        abandoned graph stops after its current step.
+        """
+        agent = agent or self.agent
+        states = queue.Queue()
+        abandoned = threading.Event()
+
+        def produce():
+            try:
+                for state in agent.stream({"messages": messages}, config=config, stream_mode="values"):
+                    states.put((state, None))
+                    if abandoned.is_set():
+                        break
+            except BaseException as e:
+                states.put((None, e))
+                return
+            states.put((None, None))
+
+        threading.Thread(target=produce, name="agent_stream", daemon=True).start()
+        try:
+            while True:
+                try:
+                    state, error = states.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise TimeoutError("Agent step exceeded the request deadline") from None
+                if error is not None:
+                    raise error
+                if state is None:
+                    return
+                yield state
+        finally:
+            abandoned.set()
+
+    def _run_agent(
+        self,
+        messages: List,
+        question: str,
+        verbose: bool = True,
+        deadline: Optional[float] = None,
+        temperature: Optional[float] = None,
+    ) -> Tuple[str, str, List]:
+        """
+        Run the agent graph within the step and wall-clock budget.
+
+        The graph is abandoned as soon as its share of the budget is exhausted, even
+        mid-call; the answer is then generated from whatever context the tools
+        gathered so far, within the rest of the budget. Without gathered context, or
+        when that call fails too, a short canned reply is returned instead of
+        retrying from scratch.
+
+        Args:
+            messages: Conversation messages ending with the current question
+            question: The current question
+            verbose: Whether to print debug information
+            deadline: time.monotonic() deadline of the request (defaults to request_timeout from now)
+            temperature: Optional temperature override for this run
+
+        Returns:
+            Tuple of (response text, finish reason, retrieved documents). The finish
+            reason is "stop" on normal completion, "timeout" when the deadline was
+            hit, "max_steps" when the tool-call iteration limit was reached and
+            "error" when the model or tools failed.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.request_timeout
+        graph_deadline = deadline - self.request_timeout * SYNTHESIS_BUDGET_SHARE
+        llm, agent = self._models_for(temperature)
+        state_messages = list(messages)
+        tool_steps = 0
+        finish_reason = None
+
+        def is_final_answer(msgs: List) -> bool:
+            last = msgs[-1]
+            return len(msgs) > len(messages) and isinstance(last, AIMessage) and not last.tool_calls
 
         try:
-            response = self.agent.invoke({"messages": messages})
-            response_text = response["messages"][-1].content
+            if time.monotonic() >= graph_deadline:
+                raise TimeoutError("No budget left for the agent")
+            for state in self._stream_until(
+                graph_deadline,
+                messages,
+                # Safety net: each step is a model + tools superstep, plus the final answer
+                config={
+                    "recursion_limit": 2 * self.max_agent_steps + 3,
+                    # Tool calls requested in the same turn are dispatched concurrently
+                    "max_concurrency": self.tool_concurrency,
+                },
+                agent=agent,
+            ):
+                state_messages = state.get("messages", state_messages)
+                if is_final_answer(state_messages):
+                    continue
+                last = state_messages[-1]
+                if isinstance(last, AIMessage) and last.tool_calls:
+                    tool_steps += 1
+                    if tool_steps > self.max_agent_steps:
+                        finish_reason = "max_steps"
+                        break
+        except GraphRecursionError:
+            finish_reason = "max_steps"
         except Exception as e:
+            finish_reason = "timeout" if is_timeout_error(e) else "error"
             if verbose:
-                print(f"Agent invocation failed, using simple RAG fallback: {e}")
+                print(f"Agent invocation stopped ({finish_reason}): {e}")
 
-            # Simple RAG fallback: attempt diversified retrieval across both types
-            ctx_docs = []
-            try:
-                ctx_docs += self.vector_store.max_marginal_relevance_search(
-                    question,
-                    k=self.k_results,
-                    fetch_k=max(20, self.k_results * self.fetch_k_multiplier),
-                    filter={"type": "general"},
-                )
-            except Exception:
-                ctx_docs += self.vector_store.similarity_search(
-                    question, k=self.k_results
-                )
-            try:
-                ctx_docs += self.vector_store.max_marginal_relevance_search(
-                    question,
-                    k=self.k_results,
-                    fetch_k=max(20, self.k_results * self.fetch_k_multiplier),
-                    filter={"type": "noticia"},
-                )
-            except Exception as e:
-                print(f"Noticia MMR search failed, skipping: {e}")
+        gathered = state_messages[len(messages):]
+        docs = self._gathered_documents(gathered)
+        if finish_reason is None and is_final_answer(state_messages):
+            return state_messages[-1].content, "stop", docs
 
-            context_blob = "\n\n".join(
-                [f"Source: {d.metadata}\nContent: {d.page_content}" for d in ctx_docs]
+        finish_reason = finish_reason or "stop"
+        if not any(isinstance(m, ToolMessage) for m in gathered):
+            return BUDGET_EXHAUSTED_REPLY, finish_reason, docs
+
+        if verbose:
+            print(f"Agent budget exhausted ({finish_reason}), answering from gathered context")
+        try:
+            response_text = self._run_until(
+                deadline, lambda: self._answer_from_gathered_context(question, gathered, llm)
             )
-            response_text = self.llm.invoke(f"{context_blob}\n\nQuestion: {question}").content
+        except Exception as e:
+            if verbose:
+                print(f"Answering from gathered context failed: {e}")
+            return BUDGET_EXHAUSTED_REPLY, "timeout" if is_timeout_error(e) else "error", docs
+        return response_text, finish_reason, docs
+
+    def query(self, question: str, verbose: bool = True) -> str:
+        """
+        Query the agent without history (for simple CLI usage).
+        For web API with history, use query_with_history instead.
+        """
+        messages = [HumanMessage(content=question)]
+        response_text, _, _ = self._run_agent(messages, question, verbose=verbose)
 
         self.conversation_history.append((question, response_text))
         return response_text
 
-    def query_with_history(
+    def answer_with_history(
         self,
         question: str,
         conversation_history: List[Tuple[str, str]] = None,
         temperature: Optional[float] = None,
-        verbose: bool = True
-    ) -> str:
+        verbose: bool = True,
+        admit: Optional[Callable[[], ContextManager]] = None
+    ) -> Dict[str, Any]:
         """
         Query the agent with externally provided conversation history.
         This method does NOT persist to database - history management is external.
-        
+
         Args:
             question: The current question to answer
             conversation_history: List of (question, answer) tuples representing previous conversation
             temperature: Optional temperature override for this query
             verbose: Whether to print debug information
-            
+            admit: Optional context manager factory held while the answer is computed
+                (e.g. an admission slot); callers coalesced onto an in-flight identical
+                question wait for it without entering it
+
         Returns:
-            The agent's response as a string
+            Dict with the response text ("answer"), the "finish_reason", the
+            "route" taken ("faq" pre-computed answer, "general"/"noticia" fast path or "agent")
+            and the "sources" the answer was based on (see utils.compact_sources)
         """
+        def compute() -> Dict[str, Any]:
+            if admit is None:
+                return self._answer(question, conversation_history, temperature, verbose)
+            with admit():
+                return self._answer(question, conversation_history, temperature, verbose)
+
+        if not self.coalesce_requests:
+            return compute()
+
+        # Concurrent identical questions share one in-flight computation
+        key = (
+            normalize_question(question),
+            tuple((normalize_question(q), a.strip()) for q, a in (conversation_history or [])),
+            temperature,
+        )
+        return dict(self._single_flight.do(key, compute))
+
+    def _answer(
+        self,
+        question: str,
+        conversation_history: Optional[List[Tuple[str, str]]],
+        temperature: Optional[float],
+        verbose: bool,
+    ) -> Dict[str, Any]:
+        """Compute the answer for answer_with_history (FAQ, fast path or bounded agent loop)."""
+        # One wall-clock budget covers the fast path, the agent loop and the final answer
+        deadline = time.monotonic() + self.request_timeout
+        if not conversation_history:
+            try:
+                faq_entry = self._match_faq(question)
+            except Exception as e:
+                faq_entry = None
+                if verbose:
+                    print(f"FAQ lookup failed: {e}")
+            if faq_entry is not None:
+                return {
+                    "answer": faq_entry["answer"],
+                    "finish_reason": "stop",
+                    "route": "faq",
+                    "sources": faq_entry.get("sources", []),
+                }
+
         messages = []
         
         # Add conversation history from parameter (if provided)
@@ -343,57 +1057,62 @@ class RAGAgent:
         # Current question
         messages.append(HumanMessage(content=question))
         
-        # Temporarily override temperature if provided
-        original_temp = None
-        if temperature is not None:
-            original_temp = self.llm.temperature
-            self.llm.temperature = temperature
-        
-        try:
-            response = self.agent.invoke({"messages": messages})
-            response_text = response["messages"][-1].content
-        except Exception as e:
-            if verbose:
-                print(f"Agent invocation failed, using simple RAG fallback: {e}")
-            
-            # Simple RAG fallback: attempt diversified retrieval across both types
-            ctx_docs = []
+        # The temperature override travels with this request instead of changing the shared model
+        llm, _ = self._models_for(temperature)
+        route = self._route_question(question, conversation_history)
+        response_text = None
+        if route:
             try:
-                ctx_docs += self.vector_store.max_marginal_relevance_search(
-                    question,
-                    k=self.k_results,
-                    fetch_k=max(20, self.k_results * self.fetch_k_multiplier),
-                    filter={"type": "general"},
+                response_text, docs = self._run_until(
+                    deadline, lambda: self.answer_from_partition(question, route, llm)
                 )
-            except Exception:
-                ctx_docs += self.vector_store.similarity_search(
-                    question, k=self.k_results
-                )
-            try:
-                ctx_docs += self.vector_store.max_marginal_relevance_search(
-                    question,
-                    k=self.k_results,
-                    fetch_k=max(20, self.k_results * self.fetch_k_multiplier),
-                    filter={"type": "noticia"},
-                )
-            except Exception:
-                # Failure to retrieve "noticia" type documents is non-fatal;
-                # fallback will proceed with whatever documents were retrieved.
-                pass
-            
-            context_blob = "\n\n".join(
-                [f"Source: {d.metadata}\nContent: {d.page_content}" for d in ctx_docs]
+            except Exception as e:
+                if verbose:
+                    print(f"Fast path failed, using agent: {e}")
+        if response_text is not None:
+            finish_reason = "stop"
+        else:
+            route = "agent"
+            response_text, finish_reason, docs = self._run_agent(
+                messages, question, verbose=verbose, deadline=deadline, temperature=temperature
             )
-            
-            # Build simple prompt with context
-            prompt = f"Context:\n{context_blob}\n\nQuestion: {question}\n\nAnswer:"
-            response_text = self.llm.invoke(prompt).content
-        finally:
-            # Restore original temperature if it was overridden
-            if original_temp is not None:
-                self.llm.temperature = original_temp
-        
-        return response_text
+
+        return {
+            "answer": response_text,
+            "finish_reason": finish_reason,
+            "route": route,
+            "sources": compact_sources(docs),
+        }
+
+    def prime_query_embeddings(self, questions: List[str]) -> None:
+        """
+        Embed a known set of questions in one provider call ahead of answering them,
+        so their retrievals do not embed one query at a time.
+        No-op when query batching is disabled.
+        """
+        if isinstance(self.embeddings, BatchingEmbeddings) and questions:
+            self.embeddings.prime(questions)
+
+    def query_with_history(
+        self,
+        question: str,
+        conversation_history: List[Tuple[str, str]] = None,
+        temperature: Optional[float] = None,
+        verbose: bool = True
+    ) -> str:
+        """
+        Query the agent with externally provided conversation history.
+        See answer_with_history for the variant that also reports the finish reason.
+
+        Returns:
+            The agent's response as a string
+        """
+        return self.answer_with_history(
+            question,
+            conversation_history=conversation_history,
+            temperature=temperature,
+            verbose=verbose,
+        )["answer"]
 
 if __name__ == "__main__":
     # Example usage for CLI testing
@@ -0,0 +1,219 @@
+"""
+Refresh Scheduler
+Periodically runs an incremental crawl and an incremental vectorization at low CPU/IO
+priority, so news stays current without restarts. A refresh publishes a new index
+version through the alias; serving processes pick it up by hot reload. Runs inside
+the API process or as a sidecar (python refresh_scheduler.py).
+"""
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Callable, List, Optional
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from index_versions import read_alias
+from utils import file_lock
+
+STATUS_FILE = "refresh_status.json"
+LOCK_FILE = "refresh.lock"
+
+
+def refresh_status_path(persist_directory: str) -> str:
+    """Path of the refresh status file inside the index root"""
+    return os.path.join(persist_directory, STATUS_FILE)
+
+
+def read_refresh_status(persist_directory: str) -> Optional[dict]:
+    """Last written refresh status, or None when no refresh ever ran"""
+    try:
+        with open(refresh_status_path(persist_directory), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class RefreshScheduler:
+    """
+    Runs crawler.py --incremental then vectorize_documents.py --incremental every
+    `interval` seconds in child processes with raised niceness (and idle IO class
+    where ionice exists). The status is written to a file in the index root, so
+    every serving process (including pre-forked workers) can report it.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        persist_directory: str = "./chroma_db",
+        nice: int = 10,
+        crawl_timeout: float = 1800,
+        vectorize_timeout: float = 1800,
+        vectorize_workers: int = 1,
+        on_published: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Args:
+            interval: Seconds between the end of a refresh and the start of the next
+            persist_directory: Index root (alias and status file location)
+            nice: Niceness added to the refresh processes
+            crawl_timeout: Seconds before the crawl is killed
+            vectorize_timeout: Seconds before the vectorization is killed
+            vectorize_workers: Embedding workers of the vectorization
+            on_published: Called after a refresh published a new index version
+        """
+        self.interval = float(interval)
+        self.persist_directory = persist_directory
+        self.nice = int(nice)
+        self.crawl_timeout = crawl_timeout
+        self.vectorize_timeout = vectorize_timeout
+        self.vectorize_workers = max(1, int(vectorize_workers))
+        self.on_published = on_published
+        self._run_lock = threading.Lock()
+        self._status = read_refresh_status(persist_directory) or {}
+        self._status["state"] = "idle"
+
+    def _write_status(self, **changes) -> None:
+        """Update the status and atomically replace the status file"""
+        self._status.update(changes)
+        os.makedirs(self.persist_directory, exist_ok=True)
+        path = refresh_status_path(self.persist_directory)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._status, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _live_version(self) -> Optional[str]:
+        alias = read_alias(self.persist_directory)
+        return os.path.basename(os.path.normpath(alias["path"])) if alias else None
+
+    def _command(self, script: str) -> List[str]:
+        # Priorities are set by wrapper commands: preexec_fn is unsafe in a threaded server
+        command = [sys.executable, script, "--incremental"]
+        if self.nice > 0 and shutil.which("nice"):
+            command = ["nice", "-n", str(self.nice)] + command
+        if shutil.which("ionice"):
+            command = ["ionice", "-c3"] + command
+        return command
+
+    def _run_step(self, script: str, timeout: float) -> None:
+        """Run one refresh step at low priority, raising on failure"""
+        env = dict(os.environ, VECTORIZE_WORKERS=str(self.vectorize_workers))
+        result = subprocess.run(
+            self._command(script),
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+        if result.returncode != 0:
+            tail = (result.stderr or result.stdout).strip()[-500:]
+            raise RuntimeError(f"{script} exited with {result.returncode}: {tail}")
+
+    def run_once(self) -> bool:
+        """
+        Run one refresh unless one is already running
+
+        Returns:
+            True if a new index version was published
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return False
+        try:
+            index_before = self._live_version()
+            self._write_status(state="running", lastStartedAt=datetime.now().isoformat(), nextRunAt=None)
+            print("Refresh: incremental crawl...")
+            self._run_step("crawler.py", self.crawl_timeout)
+            print("Refresh: incremental vectorization...")
+            self._run_step("vectorize_documents.py", self.vectorize_timeout)
+
+            index_after = self._live_version()
+            published = index_after != index_before
+            self._write_status(
+                state="idle",
+                lastFinishedAt=datetime.now().isoformat(),
+                lastResult="published" if published else "unchanged",
+                lastError=None,
+                index=index_after,
+            )
+            print(f"Refresh done: {'published ' + str(index_after) if published else 'index unchanged'}")
+        except Exception as e:
+            print(f"Refresh failed, keeping current index: {e}", file=sys.stderr)
+            self._write_status(
+                state="idle",
+                lastFinishedAt=datetime.now().isoformat(),
+                lastResult="failed",
+                lastError=str(e),
+            )
+            return False
+        finally:
+            self._run_lock.release()
+
+        if published and self.on_published is not None:
+            try:
+                self.on_published()
+            except Exception as e:
+                print(f"Reload after refresh failed: {e}", file=sys.stderr)
+        return published
+
+    def run_forever(self, exclusive: bool = False) -> None:
+        """
+        Refresh every `interval` seconds, blocking the calling thread
+
+        Args:
+            exclusive: First wait until no other scheduler runs on the same index root,
+                so only one of several sidecars (e.g. one per server worker) refreshes
+        """
+        if exclusive:
+            with file_lock(os.path.join(self.persist_directory, LOCK_FILE)):
+                # The scheduler that held the lock may have written newer status meanwhile
+                self._status = dict(read_refresh_status(self.persist_directory) or {}, state="idle")
+                return self.run_forever()
+        while True:
+            next_run = datetime.now() + timedelta(seconds=self.interval)
+            self._write_status(nextRunAt=next_run.isoformat())
+            time.sleep(self.interval)
+            self.run_once()
+
+    def start(self) -> threading.Thread:
+        """Run refreshes in a daemon thread, the first one after `interval` seconds"""
+        thread = threading.Thread(target=self.run_forever, name="refresh_scheduler", daemon=True)
+        thread.start()
+        return thread
+
+
+def scheduler_from_env(on_published: Optional[Callable[[], None]] = None) -> Optional[RefreshScheduler]:
+    """Build the scheduler from environment settings, or None when refreshes are disabled"""
+    interval_hours = float(os.getenv("REFRESH_INTERVAL_HOURS", "0"))
+    if interval_hours <= 0:
+        return None
+    return RefreshScheduler(
+        interval=interval_hours * 3600,
+        persist_directory=os.getenv("CHROMA_DB_PATH", "./chroma_db"),
+        nice=int(os.getenv("REFRESH_NICE", "10")),
+        crawl_timeout=float(os.getenv("REFRESH_CRAWL_TIMEOUT", "1800")),
+        vectorize_timeout=float(os.getenv("REFRESH_VECTORIZE_TIMEOUT", "1800")),
+        vectorize_workers=int(os.getenv("REFRESH_VECTORIZE_WORKERS", "1")),
+        on_published=on_published,
+    )
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Refresh the corpus and index periodically")
+    parser.add_argument("--once", action="store_true", help="Run one refresh and exit")
+    args = parser.parse_args()
+
+    if args.once:
+        os.environ.setdefault("REFRESH_INTERVAL_HOURS", "1")
+    scheduler = scheduler_from_env()
+    if scheduler is None:
+        parser.error("set REFRESH_INTERVAL_HOURS > 0, or pass --once")
+    if args.once:
+        scheduler.run_once()
+        sys.exit(1 if read_refresh_status(scheduler.persist_directory).get("lastResult") == "failed" else 0)
+    scheduler.run_forever(exclusive=True)
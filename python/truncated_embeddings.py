@@ -0,0 +1,40 @@
+"""
+Truncated Embeddings
+Dimensionality-reduced embeddings (Matryoshka-style truncation) for smaller, faster indexes
+"""
+import math
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+
+class TruncatedEmbeddings(Embeddings):
+    """
+    Keep only the first `dimensions` components of each vector and re-normalize it.
+
+    Meant for models trained with Matryoshka representation learning (e.g.
+    nomic-embed-text v1.5), where a prefix of the vector keeps most of the retrieval
+    quality. OpenAI text-embedding-3 models support this natively through the
+    `dimensions` parameter instead.
+    """
+
+    def __init__(self, embeddings: Embeddings, dimensions: int) -> None:
+        """
+        Args:
+            embeddings: Underlying embeddings client
+            dimensions: Number of leading components to keep
+        """
+        self.embeddings = embeddings
+        self.dimensions = int(dimensions)
+
+    def _truncate(self, vector: List[float]) -> List[float]:
+        head = vector[:self.dimensions]
+        norm = math.sqrt(sum(x * x for x in head)) or 1.0
+        return [x / norm for x in head]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents and truncate each vector"""
+        return [self._truncate(v) for v in self.embeddings.embed_documents(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query and truncate the vector"""
+        return self._truncate(self.embeddings.embed_query(text))
@@ -2,8 +2,16 @@
 Utility functions for RAG Agent
 Formatting helpers and other reusable utilities
 """
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
 import os
+import queue
+import re
+import threading
+import time
+import unicodedata
 
 
 def configure_gpu_settings(num_gpu: int = 1, cuda_device: int = 0):
@@ -38,6 +46,38 @@ def configure_gpu_settings(num_gpu: int = 1, cuda_device: int = 0):
         return 0
 
 
+def directory_size(path: str) -> int:
+    """Total size in bytes of the files under a directory"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def hnsw_configuration_from_env() -> Optional[Dict[str, Any]]:
+    """
+    Build the Chroma HNSW collection configuration from environment variables
+    
+    Reads HNSW_SPACE (l2, cosine, ip), HNSW_M, HNSW_EF_CONSTRUCTION and HNSW_EF_SEARCH;
+    unset variables keep Chroma's defaults.
+    
+    Returns:
+        Collection configuration dict, or None when nothing is configured
+    """
+    hnsw = {}
+    if os.getenv("HNSW_SPACE"):
+        hnsw["space"] = os.getenv("HNSW_SPACE")
+    for env_name, key in (
+        ("HNSW_M", "max_neighbors"),
+        ("HNSW_EF_CONSTRUCTION", "ef_construction"),
+        ("HNSW_EF_SEARCH", "ef_search"),
+    ):
+        if os.getenv(env_name):
+            hnsw[key] = int(os.getenv(env_name))
+    return {"hnsw": hnsw} if hnsw else None
+
+
 def format_document_context(retrieved_docs: List, include_metadata: bool = True) -> str:
     """
     Format retrieved documents with metadata for context
@@ -78,3 +118,236 @@ def format_document_context(retrieved_docs: List, include_metadata: bool = True)
             )
     
     return "\n".join(formatted_chunks)
+
+
+
+def compact_sources(retrieved_docs: List) -> List[Dict[str, Any]]:
+    """
+    Deduplicated citation list for retrieved documents, in retrieval order
+    
+    Args:
+        retrieved_docs: Retrieved Document objects
+        
+    Returns:
+        One dict per source page with "url", "title", "type" and, when known,
+        "date" and "fetchedAt"
+    """
+    sources = {}
+    for doc in retrieved_docs:
+        metadata = getattr(doc, "metadata", None) or {}
+        url = metadata.get("source_url")
+        if not url or url in sources:
+            continue
+        source = {"url": url, "title": metadata.get("title"), "type": metadata.get("type")}
+        if metadata.get("date"):
+            source["date"] = metadata["date"]
+        if metadata.get("fetched_at"):
+            source["fetchedAt"] = metadata["fetched_at"]
+        sources[url] = source
+    return list(sources.values())
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for deduplication and cache keys
+    
+    Args:
+        question: Raw question text
+        
+    Returns:
+        Case-folded question with collapsed whitespace and no trailing punctuation
+    """
+    normalized = unicodedata.normalize("NFKC", question).casefold()
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return normalized.rstrip(" ?!.¿¡")
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls sharing the same key: the first caller runs the
+    function, later callers arriving while it is in flight wait for and receive
+    the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn for key, or join the computation already in flight for it
+        
+        Args:
+            key: Hashable deduplication key
+            fn: Zero-argument callable producing the result
+            
+        Returns:
+            The result of the shared computation
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock on a file for the duration of the block, waiting while
+    another process holds it. The lock is released when the holder exits or dies.
+
+    Args:
+        path: Lock file (created if missing)
+    """
+    import fcntl
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with an optional time-to-live per entry
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        """
+        Args:
+            max_size: Maximum number of entries (the least recently used is evicted)
+            ttl: Seconds an entry stays valid, or None to keep entries until evicted
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store value for key, evicting the least recently used entries if full"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Entry count and hit/miss counters"""
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class MicroBatcher:
+    """
+    Collect items submitted concurrently from several threads and process them with
+    a single call of batch_fn, then hand each caller its own result.
+
+    A batch is flushed when it reaches max_batch_size or when max_wait_ms has passed
+    since its first item arrived. Up to max_in_flight batches are processed at once,
+    so one slow call does not hold up the batches behind it; while all are busy,
+    new items keep accumulating into the next batch.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "micro_batcher",
+        max_in_flight: int = 4,
+    ):
+        """
+        Args:
+            batch_fn: Function mapping a list of items to a list of results (same order)
+            max_batch_size: Maximum number of items per call
+            max_wait_ms: Maximum time the first item of a batch waits for others
+            name: Name of the background collector thread (and prefix of the call threads)
+            max_in_flight: Maximum number of batch_fn calls running at the same time
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._queue: "queue.Queue" = queue.Queue()
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=name)
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Queue an item and block until its batch has been processed
+        
+        Args:
+            item: Item to process
+            timeout: Optional maximum time to wait for the result in seconds
+            
+        Returns:
+            The result of batch_fn for this item
+        """
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result(timeout=timeout)
+
+    def _run(self) -> None:
+        while True:
+            # Wait for a free call slot first, so items queue up into a fuller batch meanwhile
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._process, batch)
+
+    def _process(self, batch: List[tuple]) -> None:
+        try:
+            results = self.batch_fn([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
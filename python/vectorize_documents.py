@@ -7,19 +7,34 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+from itertools import chain
+import argparse
 import json
 import os
 import re
-from utils import configure_gpu_settings
+import shutil
+import sys
+import tempfile
+import time
+from utils import configure_gpu_settings, directory_size, hnsw_configuration_from_env
+from truncated_embeddings import TruncatedEmbeddings
+from local_embeddings import LocalEmbeddings, DEFAULT_LOCAL_EMBEDDING_MODEL
+from chunk_dedup import ChunkDeduplicator, content_hash, make_chunk_id
+from index_versions import new_version_directory, publish_version, prune_versions, read_alias
+from corpus_store import CorpusStore, corpus_exists, page_filename
 
 
 load_dotenv()
 
 PROVIDER = os.getenv("MODEL_PROVIDER", "openai").lower()
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", PROVIDER).lower()
 
-if PROVIDER == "ollama":
+if EMBEDDING_PROVIDER == "ollama":
     num_gpus = configure_gpu_settings(num_gpu=1, cuda_device=0)
 
 
@@ -54,153 +69,415 @@ def extract_metadata_from_filename(filename: str) -> dict:
     return metadata
 
 
+DATE_PATTERNS = [
+    re.compile(
+        r'(\d{1,2}\s+(?:GENER|FEBRER|MARÇ|ABRIL|MAIG|JUNY|JULIOL|AGOST|SETEMBRE|OCTUBRE|NOVEMBRE|DESEMBRE)\s+\d{4})',
+        re.IGNORECASE,
+    ),
+    re.compile(r'(\d{1,2}/\d{1,2}/\d{4})'),
+    re.compile(r'(\d{4}-\d{2}-\d{2})'),
+]
+
+CATALAN_MONTHS = {
+    'GENER': 1, 'FEBRER': 2, 'MARÇ': 3, 'ABRIL': 4, 'MAIG': 5, 'JUNY': 6,
+    'JULIOL': 7, 'AGOST': 8, 'SETEMBRE': 9, 'OCTUBRE': 10, 'NOVEMBRE': 11, 'DESEMBRE': 12,
+}
+
+# Listed by priority: when several appear, the earliest in this list wins
+CATEGORIES = ['NOTÍCIES', 'MATRÍCULES', 'BEQUES', 'CONVOCATÒRIES', 'PREINSCRIPCIÓ',
+              'CALENDARI', 'EXÀMENS', 'FP', 'ESO', 'BATXILLERAT']
+CATEGORY_PRIORITY = {category: i for i, category in enumerate(CATEGORIES)}
+CATEGORY_PATTERN = re.compile(
+    '|'.join(re.escape(c) for c in sorted(CATEGORIES, key=len, reverse=True)),
+    re.IGNORECASE,
+)
+
+
 def extract_date_from_content(content: str) -> str:
     """Extract date from content if present"""
-    date_patterns = [
-        r'(\d{1,2}\s+(?:GENER|FEBRER|MARÇ|ABRIL|MAIG|JUNY|JULIOL|AGOST|SETEMBRE|OCTUBRE|NOVEMBRE|DESEMBRE)\s+\d{4})',
-        r'(\d{1,2}/\d{1,2}/\d{4})',
-        r'(\d{4}-\d{2}-\d{2})'
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, content, re.IGNORECASE)
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(content)
         if match:
             return match.group(1)
     
     return None
 
 
+def parse_date(date_str: str) -> Optional[date]:
+    """
+    Normalize a date found by extract_date_from_content ("12 GENER 2024",
+    "12/01/2024" as day/month/year, or ISO "2024-01-12") into a date
+    """
+    try:
+        if '/' in date_str:
+            day, month, year = (int(part) for part in date_str.split('/'))
+            return date(year, month, day)
+        if '-' in date_str:
+            return date.fromisoformat(date_str)
+        day, month_name, year = date_str.split()
+        return date(int(year), CATALAN_MONTHS[month_name.upper()], int(day))
+    except (ValueError, KeyError):
+        return None
+
+
+def date_metadata(date_str: str) -> dict:
+    """Numeric date fields usable in Chroma range filters and recency ranking"""
+    parsed = parse_date(date_str)
+    if parsed is None:
+        return {}
+    epoch = datetime(parsed.year, parsed.month, parsed.day, tzinfo=timezone.utc).timestamp()
+    return {
+        'date_ts': int(epoch),
+        'date_ordinal': parsed.toordinal(),
+    }
+
+
 def extract_category_from_content(content: str) -> str:
-    """Extract category from content (e.g., NOTÍCIES, MATRÍCULES)"""
-    categories = ['NOTÍCIES', 'MATRÍCULES', 'BEQUES', 'CONVOCATÒRIES', 'PREINSCRIPCIÓ', 
-                  'CALENDARI', 'EXÀMENS', 'FP', 'ESO', 'BATXILLERAT']
+    """Extract category from content (e.g., NOTÍCIES, MATRÍCULES) in a single scan"""
+    best = None
+    for match in CATEGORY_PATTERN.finditer(content):
+        priority = CATEGORY_PRIORITY[match.group(0).upper()]
+        if best is None or priority < best:
+            best = priority
+            if best == 0:
+                break
+    
+    return CATEGORIES[best] if best is not None else 'GENERAL'
+
+
+def document_from_page(data: dict, filename: str) -> Optional[Document]:
+    """
+    Build a Document with enhanced metadata from crawled page data
+    
+    Args:
+        data: Page data (title, content, type and, for newer crawls, url/fetched_at/content_hash)
+        filename: Page file name in the per-file layout, used for filename-derived metadata
+    
+    Returns:
+        The Document, or None when the page has no content
+    """
+    metadata = extract_metadata_from_filename(filename)
+    # Crawls that record the page URL make the filename-derived one unnecessary
+    if '://' in (data.get('url') or ''):
+        metadata['source_url'] = data['url']
+    if data.get('fetched_at'):
+        metadata['fetched_at'] = data['fetched_at']
+    if data.get('content_hash'):
+        metadata['page_hash'] = data['content_hash']
+    
+    title = data.get('title') or 'Sense títol'
+    content = data.get('content', '')
+    
+    if not content:
+        print(f"Warning: Empty content in {filename}")
+        return None
+    
+    metadata['title'] = title
+    
+    doc_type = data.get('type', 'general')
+    metadata['type'] = doc_type
+    
+    date_str = extract_date_from_content(content)
+    if date_str:
+        metadata['date'] = date_str
+        metadata.update(date_metadata(date_str))
+    
+    category = extract_category_from_content(content)
+    metadata['category'] = category
     
-    for category in categories:
-        if category in content.upper():
-            return category
+    enriched_content = f"Títol: {title}\n\n{content}"
     
-    return 'GENERAL'
+    return Document(
+        page_content=enriched_content,
+        metadata=metadata
+    )
 
 
-def load_documents(folder_path: str) -> List[Document]:
+def load_document_file(file_path: str) -> Optional[Document]:
     """
-    Load documents from a folder containing JSON files with enhanced metadata extraction
+    Load a single crawled JSON file into a Document with enhanced metadata.
+    
+    Returns:
+        The Document, or None when the file is empty or cannot be read
     """
-    documents = []
+    filename = os.path.basename(file_path)
     
-    for filename in os.listdir(folder_path):
-        if not filename.endswith('.json'):
-            print(f"Skipping unsupported file type: {filename}")
-            continue
-            
-        file_path = os.path.join(folder_path, filename)
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return document_from_page(data, filename)
         
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            metadata = extract_metadata_from_filename(filename)
-            
-            title = data.get('title', 'Sense títol')
-            content = data.get('content', '')
-            
-            if not content:
-                print(f"Warning: Empty content in {filename}")
-                continue
-            
-            metadata['title'] = title
-            
-            doc_type = data.get('type', 'general')
-            metadata['type'] = doc_type
-            
-            date = extract_date_from_content(content)
-            if date:
-                metadata['date'] = date
-            
-            category = extract_category_from_content(content)
-            metadata['category'] = category
-            
-            enriched_content = f"Títol: {title}\n\n{content}"
-            
-            doc = Document(
-                page_content=enriched_content,
-                metadata=metadata
-            )
-            
-            documents.append(doc)
-            
-        except Exception as e:
-            print(f"Error loading {filename}: {str(e)}")
-            continue
-    
-    print(f"Successfully loaded {len(documents)} documents")
-    return documents
+    except Exception as e:
+        print(f"Error loading {filename}: {str(e)}")
+        return None
 
 
-def vectorize_and_persist(
-    data_folder: str = "./data",
-    persist_directory: str = "./chroma_db",
-    collection_name: str = "ioc_data",
-    chunk_size: int = 800, 
-    chunk_overlap: int = 150, 
-    embedding_model: str = "nomic-embed-text"
-):
+def load_source(source) -> Optional[Document]:
+    """
+    Load one corpus item: a JSON file path or a page row from the corpus store.
+    Runs inside loader worker processes, so it only takes picklable arguments.
+    """
+    if isinstance(source, str):
+        return load_document_file(source)
+    try:
+        return document_from_page(source, page_filename(source['url']))
+    except Exception as e:
+        print(f"Error loading {source.get('url')}: {str(e)}")
+        return None
+
+
+def iter_sources(
+    folder_path: str,
+    corpus_path: Optional[str] = None,
+    changed_since: Optional[str] = None,
+) -> Iterator:
     """
-    Load documents, split them, create embeddings, and persist to ChromaDB
+    Stream the corpus items: page rows from the corpus store when it has pages,
+    otherwise the JSON files of the folder
     
     Args:
-        data_folder: Path to folder containing documents
-        persist_directory: Path to persist ChromaDB
-        collection_name: Name of the ChromaDB collection
-        chunk_size: Size of text chunks (optimized to 800)
-        chunk_overlap: Overlap between chunks (optimized to 150)
-        embedding_model: Name of embedding model (provider-specific: OpenAI or Ollama)
+        changed_since: Only store pages whose content changed at or after this ISO timestamp
     """
-    print(f"Loading documents from {data_folder}...")
-    documents = load_documents(data_folder)
+    if corpus_path and corpus_exists(corpus_path):
+        print(f"Reading pages from corpus store {corpus_path}")
+        with CorpusStore(corpus_path) as store:
+            yield from store.iter_pages(changed_since=changed_since)
+        return
+    yield from iter_json_files(folder_path)
+
+
+def iter_json_files(folder_path: str) -> Iterator[str]:
+    """Stream the paths of the JSON files in a folder without listing it up front"""
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                print(f"Skipping unsupported file type: {entry.name}")
+                continue
+            yield entry.path
+
+
+def stream_in_pool(
+    func: Callable,
+    items: Iterable,
+    workers: int,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> Iterator:
+    """
+    Map func over items in a process pool, yielding results in input order.
     
-    if not documents:
-        print("ERROR: No documents loaded!")
-        return None
+    At most a few items per worker are in flight at any time, so memory stays
+    flat regardless of how many items there are.
     
-    print(f"Loaded {len(documents)} documents")
+    Args:
+        func: Module-level (picklable) function applied to each item
+        items: Iterable of picklable items, consumed lazily
+        workers: Number of processes (1 runs inline without a pool)
+        initializer: Optional per-process setup function
+        initargs: Arguments for the initializer
+    """
+    if workers <= 1:
+        if initializer:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
     
-    if documents:
-        print("\nSample document metadata:")
-        sample = documents[0]
-        print(f"  Title: {sample.metadata.get('title', 'N/A')}")
-        print(f"  Type: {sample.metadata.get('type', 'N/A')}")
-        print(f"  Category: {sample.metadata.get('category', 'N/A')}")
-        print(f"  Date: {sample.metadata.get('date', 'N/A')}")
-        print(f"  Content preview: {sample.page_content[:150]}...\n")
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_documents(
+    folder_path: str,
+    workers: Optional[int] = None,
+    corpus_path: Optional[str] = None,
+) -> Iterator[Document]:
+    """
+    Stream documents from the corpus store (or a folder of JSON files), parsing them
+    in a process pool. Documents are yielded in source order.
     
-    print(f"Splitting documents into chunks (size={chunk_size}, overlap={chunk_overlap})...")
+    Args:
+        folder_path: Path to folder containing JSON files
+        workers: Number of loader processes (defaults to the CPU count, 1 loads inline)
+        corpus_path: Corpus store read instead of the folder when it has pages
+    """
+    loaded = 0
+    sources = iter_sources(folder_path, corpus_path)
+    for doc in stream_in_pool(load_source, sources, workers or os.cpu_count() or 1):
+        if doc is not None:
+            loaded += 1
+            yield doc
     
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=700,
-        chunk_overlap=120,
+    print(f"Successfully loaded {loaded} documents")
+
+
+def load_documents(
+    folder_path: str,
+    workers: Optional[int] = None,
+    corpus_path: Optional[str] = None,
+) -> List[Document]:
+    """
+    Load documents from the corpus store or a folder of JSON files with enhanced metadata extraction
+    """
+    return list(iter_documents(folder_path, workers=workers, corpus_path=corpus_path))
+
+
+def create_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Create the token-based splitter used for all chunking"""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
         separators=["\n\n", "\n", ". ", " ", ""],
     )
+
+
+def resolve_chunking_profiles(
+    chunk_size: int,
+    chunk_overlap: int,
+    profiles: Optional[dict] = None,
+) -> dict:
+    """
+    Build the per-type chunking configuration
     
-    split_docs = text_splitter.split_documents(documents)
-    print(f"Created {len(split_docs)} chunks")
+    Args:
+        chunk_size: Default chunk size in tokens
+        chunk_overlap: Default chunk overlap in tokens
+        profiles: Optional overrides by document type, e.g.
+            {"noticia": {"chunk_size": 500, "chunk_overlap": 80}}
     
-    for i, doc in enumerate(split_docs):
-        doc.metadata['chunk_id'] = i
-        preview = doc.page_content[:200].replace('\n', ' ')
-        doc.metadata['preview'] = preview
+    Returns:
+        Mapping of document type (plus "default") to (chunk_size, chunk_overlap)
+    """
+    resolved = {"default": (int(chunk_size), int(chunk_overlap))}
+    for doc_type, profile in (profiles or {}).items():
+        resolved[doc_type] = (
+            int(profile.get("chunk_size", chunk_size)),
+            int(profile.get("chunk_overlap", chunk_overlap)),
+        )
+    return resolved
+
+
+# Per-process splitters by document type, built once by the pool initializer
+_worker_splitters = {}
+
+
+def init_splitter_worker(profiles: dict) -> None:
+    """Pool initializer: build the tokenizer-backed splitters once per process"""
+    global _worker_splitters
+    _worker_splitters = {
+        doc_type: create_text_splitter(size, overlap) for doc_type, (size, overlap) in profiles.items()
+    }
+
+
+def load_and_split_source(source) -> List[Document]:
+    """Load one corpus item and split it into chunks (tokenization runs in the worker)"""
+    doc = load_source(source)
+    if doc is None:
+        return []
+    splitter = _worker_splitters.get(doc.metadata.get('type'), _worker_splitters["default"])
+    return splitter.split_documents([doc])
+
+
+def iter_chunks(
+    folder_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: Optional[int] = None,
+    profiles: Optional[dict] = None,
+    corpus_path: Optional[str] = None,
+    changed_since: Optional[str] = None,
+) -> Iterator[Document]:
+    """
+    Stream chunks for every document in the corpus; loading, metadata extraction and
+    tokenization are spread across a process pool.
     
-    print(f"Creating embeddings using {embedding_model} with provider {PROVIDER}...")
+    Args:
+        folder_path: Path to folder containing JSON files
+        chunk_size: Default chunk size in tokens
+        chunk_overlap: Default chunk overlap in tokens
+        workers: Loader/tokenizer processes (defaults to the CPU count)
+        profiles: Optional per-type overrides (see resolve_chunking_profiles)
+        corpus_path: Corpus store read instead of the folder when it has pages
+        changed_since: Only store pages whose content changed at or after this ISO timestamp
+    """
+    for chunks in stream_in_pool(
+        load_and_split_source,
+        iter_sources(folder_path, corpus_path, changed_since),
+        workers or os.cpu_count() or 1,
+        initializer=init_splitter_worker,
+        initargs=(resolve_chunking_profiles(chunk_size, chunk_overlap, profiles),),
+    ):
+        yield from chunks
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def merge_chunk_sources(vector_store: Chroma, extra_sources: dict, batch_size: int = 256) -> None:
+    """
+    Add the sources of skipped duplicate chunks to the metadata of their stored
+    canonical chunk without re-embedding it
+    
+    Args:
+        vector_store: Chroma store holding the canonical chunks
+        extra_sources: Mapping of canonical chunk ID to the set of additional source URLs
+        batch_size: Number of chunks updated per call
+    """
+    for ids in iter_batches(list(extra_sources), batch_size):
+        existing = vector_store.get(ids=ids, include=["metadatas"])
+        updated_ids, updated_metadatas = [], []
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+            sources = set(filter(None, (metadata.get('sources') or '').split('|')))
+            sources.update(extra_sources[chunk_id])
+            metadata['sources'] = '|'.join(sorted(sources))
+            metadata['source_count'] = len(sources)
+            updated_ids.append(chunk_id)
+            updated_metadatas.append(metadata)
+        vector_store._collection.update(ids=updated_ids, metadatas=updated_metadatas)
+
+
+def create_embeddings(embedding_model: str):
+    """
+    Create the embeddings client for the configured provider, reduced to
+    EMBEDDING_DIMENSIONS components when that is set
+    """
+    dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
     
-    if PROVIDER == "openai":
+    if EMBEDDING_PROVIDER == "local":
+        threads = os.getenv("LOCAL_EMBED_THREADS")
+        embeddings = LocalEmbeddings(
+            model_name=embedding_model,
+            num_threads=int(threads) if threads else None,
+            batch_size=int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "32")),
+            backend=os.getenv("LOCAL_EMBED_BACKEND", "torch"),
+        )
+    elif EMBEDDING_PROVIDER == "openai":
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
-        embeddings = OpenAIEmbeddings(
+        # text-embedding-3 models shorten their vectors natively
+        return OpenAIEmbeddings(
             model=embedding_model,
             openai_api_key=api_key,
+            dimensions=dimensions,
         )
-    elif PROVIDER == "ollama":
+    elif EMBEDDING_PROVIDER == "ollama":
         try:
             import torch
             num_gpu_param = -1 if torch.cuda.is_available() else 0
@@ -212,40 +489,585 @@ def vectorize_and_persist(
             num_gpu=num_gpu_param
         )
     else:
-        raise ValueError(f"Unsupported provider: {PROVIDER}. Choose 'ollama' or 'openai'")
+        raise ValueError(f"Unsupported provider: {EMBEDDING_PROVIDER}. Choose 'ollama', 'openai' or 'local'")
     
-    print(f"Persisting to ChromaDB at {persist_directory}...")
+    if dimensions:
+        return TruncatedEmbeddings(embeddings, dimensions)
+    return embeddings
+
+
+def vectorize_and_persist(
+    data_folder: str = "./data",
+    persist_directory: str = "./chroma_db",
+    collection_name: str = "ioc_data",
+    chunk_size: int = 800, 
+    chunk_overlap: int = 150, 
+    embedding_model: str = "nomic-embed-text",
+    batch_size: int = 256,
+    workers: Optional[int] = None,
+    deduplicate: bool = True,
+    chunking_profiles: Optional[dict] = None,
+    corpus_path: Optional[str] = None,
+):
+    """
+    Load documents, split them, create embeddings, and persist to ChromaDB.
     
-    if os.path.exists(persist_directory):
-        print("Existing database found. Creating new version...")
+    Runs as a streaming pipeline (load -> split -> enrich -> embed batch -> upsert),
+    so only a bounded number of chunks is held in memory at any time.
     
-    vector_store = Chroma.from_documents(
+    Args:
+        data_folder: Path to folder containing documents
+        persist_directory: Index root; each run builds a new version directory in it and
+            switches the CURRENT alias only after a successful smoke query
+        collection_name: Name of the ChromaDB collection
+        chunk_size: Size of text chunks in tokens (optimized to 800)
+        chunk_overlap: Overlap between chunks in tokens (optimized to 150)
+        embedding_model: Name of embedding model (provider-specific: OpenAI or Ollama)
+        batch_size: Number of chunks embedded and upserted per batch
+        workers: Loader/tokenizer processes (defaults to the CPU count)
+        deduplicate: Embed exact and near-duplicate chunks only once
+        chunking_profiles: Per-type chunk size/overlap overrides, e.g.
+            {"noticia": {"chunk_size": 500, "chunk_overlap": 80}}
+        corpus_path: Corpus store read instead of data_folder when it has pages
+    """
+    # Pages changed after this point are picked up by the next incremental refresh
+    synced_at = datetime.now(timezone.utc).isoformat()
+    print(f"Loading and splitting documents from {data_folder} (size={chunk_size}, overlap={chunk_overlap})...")
+    if chunking_profiles:
+        print(f"Per-type chunking profiles: {chunking_profiles}")
+    
+    chunks = iter_chunks(
+        data_folder,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        workers=workers,
+        profiles=chunking_profiles,
+        corpus_path=corpus_path,
+    )
+    first_chunk = next(chunks, None)
+    
+    if first_chunk is None:
+        print("ERROR: No documents loaded!")
+        return None
+    
+    print(f"Creating embeddings using {embedding_model} with provider {EMBEDDING_PROVIDER}...")
+    embeddings = create_embeddings(embedding_model)
+    
+    version_directory = new_version_directory(persist_directory)
+    print(f"Persisting new index version to ChromaDB at {version_directory}...")
+    
+    vector_store = Chroma(
         collection_name=collection_name,
-        documents=split_docs,
-        embedding=embeddings,
-        persist_directory=persist_directory
+        embedding_function=embeddings,
+        persist_directory=version_directory,
+        collection_configuration=hnsw_configuration_from_env(),
     )
     
-    print(f"\nSuccessfully vectorized and persisted {len(split_docs)} document chunks!")
-    print(f"Statistics:")
-    print(f"   - Total documents: {len(documents)}")
-    print(f"   - Total chunks: {len(split_docs)}")
-    print(f"   - Avg chunks per document: {len(split_docs)/len(documents):.1f}")
+    try:
+        stats = build_index(vector_store, chain([first_chunk], chunks), batch_size, deduplicate)
+    except BaseException:
+        shutil.rmtree(version_directory, ignore_errors=True)
+        raise
+    
+    if not validate_index(vector_store, stats["stored"]):
+        print("ERROR: Smoke query on the new index failed, keeping the current index")
+        shutil.rmtree(version_directory, ignore_errors=True)
+        return None
+    
+    publish_version(
+        persist_directory,
+        version_directory,
+        collection_name,
+        chunks=stats["stored"],
+        embedding_model=embedding_model,
+        embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+        corpus_synced_at=synced_at if corpus_path and corpus_exists(corpus_path) else None,
+    )
+    prune_versions(persist_directory)
+    print(f"Published index version {os.path.basename(version_directory)}")
     
     return vector_store
 
 
+def refresh_index(
+    corpus_path: str,
+    persist_directory: str = "./chroma_db",
+    collection_name: str = "ioc_data",
+    chunk_size: int = 800,
+    chunk_overlap: int = 150,
+    embedding_model: str = "nomic-embed-text",
+    batch_size: int = 256,
+    workers: Optional[int] = None,
+    chunking_profiles: Optional[dict] = None,
+    data_folder: str = "./data",
+) -> Optional[dict]:
+    """
+    Incrementally update the live index with the corpus pages that changed since it
+    was built, as a new version: the live version is copied, the changed pages are
+    re-chunked against a deduplicator seeded with the live chunks (so content that
+    is already stored verbatim is not embedded again), changed pages are dropped from the sources of chunks they
+    no longer contain, chunks left without sources are deleted, and the copy is
+    validated and published like a full build. Falls back to a full build when the
+    live index has no corpus watermark.
+    
+    Args:
+        corpus_path: Corpus store the crawler writes to
+        data_folder: Folder of page files read by the full-build fallback when the
+            corpus store does not exist
+        (other arguments as in vectorize_and_persist)
+    
+    Returns:
+        Refresh statistics ("pages" changed, "deleted", "updated" and "stored" chunks,
+        "version"), or None when nothing was published
+    """
+    alias = read_alias(persist_directory)
+    if not alias or not alias.get("corpus_synced_at") or not corpus_exists(corpus_path):
+        print("No incremental watermark on the live index, running a full build...")
+        vector_store = vectorize_and_persist(
+            data_folder=data_folder,
+            persist_directory=persist_directory,
+            collection_name=collection_name,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            embedding_model=embedding_model,
+            batch_size=batch_size,
+            workers=workers,
+            chunking_profiles=chunking_profiles,
+            corpus_path=corpus_path,
+        )
+        return {"full": True, "version": os.path.basename(read_alias(persist_directory)["path"])} if vector_store else None
+    
+    synced_at = datetime.now(timezone.utc).isoformat()
+    with CorpusStore(corpus_path) as store:
+        changed_urls = [page['url'] for page in store.iter_pages(changed_since=alias["corpus_synced_at"])]
+    if not changed_urls:
+        print(f"No pages changed since {alias['corpus_synced_at']}, index is up to date")
+        return {"full": False, "pages": 0, "deleted": 0, "updated": 0, "stored": 0, "version": os.path.basename(alias["path"])}
+    print(f"{len(changed_urls)} pages changed since {alias['corpus_synced_at']}")
+    
+    embeddings = create_embeddings(embedding_model)
+    live_collection = alias.get("collection_name", collection_name)
+    version_directory = new_version_directory(persist_directory)
+    print(f"Copying live index {alias['path']} to {version_directory}...")
+    
+    changed = set(changed_urls)
+    try:
+        shutil.copytree(alias["path"], version_directory, dirs_exist_ok=True)
+        vector_store = Chroma(
+            collection_name=live_collection,
+            embedding_function=embeddings,
+            persist_directory=version_directory,
+        )
+        base_count = vector_store._collection.count()
+        
+        # Seed the deduplicator with the live chunks, so unchanged and shared content is
+        # reused instead of embedded again, and note the chunks citing changed pages.
+        # Only exact matches reuse a live chunk: a lightly edited chunk is stored anew
+        # and its old version is dropped below
+        dedup = ChunkDeduplicator()
+        affected = set()
+        for chunk_id, metadata in iter_collection(vector_store, ["metadatas"], batch_size):
+            metadata = metadata or {}
+            if metadata.get("content_hash"):
+                dedup.register(chunk_id, metadata["content_hash"], dedup_scope(metadata))
+            if changed & chunk_sources(metadata):
+                affected.add(chunk_id)
+        
+        chunks = iter_chunks(
+            None,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            workers=workers,
+            profiles=chunking_profiles,
+            corpus_path=corpus_path,
+            changed_since=alias["corpus_synced_at"],
+        )
+        stats = build_index(vector_store, chunks, batch_size, dedup=dedup)
+        
+        # A live chunk keeps the changed pages that still contain it; it is deleted
+        # only when no page cites it any more
+        deleted, updated = prune_chunk_sources(vector_store, affected, changed, stats["extra_sources"], batch_size)
+    except BaseException:
+        shutil.rmtree(version_directory, ignore_errors=True)
+        raise
+    
+    expected_chunks = base_count - deleted + stats["stored"]
+    if not validate_index(vector_store, expected_chunks):
+        print("ERROR: Smoke query on the refreshed index failed, keeping the current index")
+        shutil.rmtree(version_directory, ignore_errors=True)
+        return None
+    
+    publish_version(
+        persist_directory,
+        version_directory,
+        live_collection,
+        chunks=expected_chunks,
+        embedding_model=embedding_model,
+        embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+        corpus_synced_at=synced_at,
+        refreshed_from=os.path.basename(alias["path"]),
+    )
+    prune_versions(persist_directory)
+    print(f"Published refreshed index version {os.path.basename(version_directory)}")
+    return {
+        "full": False,
+        "pages": len(changed_urls),
+        "deleted": deleted,
+        "updated": updated,
+        "stored": stats["stored"],
+        "version": os.path.basename(version_directory),
+    }
+
+
+def dedup_scope(metadata: dict) -> tuple:
+    """
+    Metadata a chunk must share with another to be merged into it: filters and
+    recency ranking by type and date only see the chunk that is stored
+    """
+    return metadata.get('type', 'general'), metadata.get('date', '')
+
+
+def chunk_sources(metadata: dict) -> set:
+    """URLs of the pages a stored chunk appears on"""
+    sources = set(filter(None, (metadata.get('sources') or '').split('|')))
+    if metadata.get('source_url'):
+        sources.add(metadata['source_url'])
+    return sources
+
+
+def iter_collection(vector_store: Chroma, include: List[str], batch_size: int = 256) -> Iterator[tuple]:
+    """Page through every stored chunk as (id, metadata[, document]) tuples"""
+    offset = 0
+    while True:
+        page = vector_store._collection.get(include=include, limit=batch_size, offset=offset)
+        if not page["ids"]:
+            break
+        columns = [page["metadatas"]] + ([page["documents"]] if "documents" in include else [])
+        yield from zip(page["ids"], *columns)
+        offset += len(page["ids"])
+
+
+def prune_chunk_sources(
+    vector_store: Chroma,
+    chunk_ids: Iterable[str],
+    changed_urls: set,
+    reclaimed: dict,
+    batch_size: int = 256,
+) -> Tuple[int, int]:
+    """
+    Drop changed pages from the sources of live chunks, unless the page's new
+    content still contains the chunk, and delete chunks left without any source
+    
+    Args:
+        vector_store: Refreshed index
+        chunk_ids: Live chunks that cited a changed page before the refresh
+        changed_urls: URLs of the changed pages
+        reclaimed: Chunk ID to the URLs whose new content matched the chunk (build_index "extra_sources")
+        batch_size: Chunks read and written per call
+    
+    Returns:
+        Tuple of (deleted, updated) chunk counts
+    """
+    deleted = updated = 0
+    for ids in iter_batches(sorted(chunk_ids), batch_size):
+        existing = vector_store.get(ids=ids, include=["metadatas"])
+        stale_ids, updated_ids, updated_metadatas = [], [], []
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+            metadata = metadata or {}
+            keep = reclaimed.get(chunk_id, set())
+            sources = {url for url in chunk_sources(metadata) if url not in changed_urls or url in keep}
+            if not sources:
+                stale_ids.append(chunk_id)
+                continue
+            if metadata.get('source_url') not in sources:
+                # The page the chunk was first stored for changed; cite a page that still has it
+                metadata['source_url'] = min(sources)
+            metadata['sources'] = '|'.join(sorted(sources))
+            metadata['source_count'] = len(sources)
+            updated_ids.append(chunk_id)
+            updated_metadatas.append(metadata)
+        if stale_ids:
+            vector_store._collection.delete(ids=stale_ids)
+            deleted += len(stale_ids)
+        if updated_ids:
+            vector_store._collection.update(ids=updated_ids, metadatas=updated_metadatas)
+            updated += len(updated_ids)
+    return deleted, updated
+
+
+def build_index(
+    vector_store: Chroma,
+    chunks: Iterable[Document],
+    batch_size: int,
+    deduplicate: bool = True,
+    dedup: Optional[ChunkDeduplicator] = None,
+) -> dict:
+    """
+    Enrich, deduplicate, embed and upsert a stream of chunks into a vector store
+    
+    Args:
+        dedup: Deduplicator already holding the chunks stored in vector_store (used
+            when extending an existing index); a fresh one is created otherwise
+    
+    Returns:
+        Build statistics ("chunks" seen, "stored" unique chunks, "source_files",
+        "extra_sources" mapping stored chunk IDs to the URLs of their skipped duplicates)
+    """
+    if dedup is None and deduplicate:
+        dedup = ChunkDeduplicator()
+    extra_sources = {}
+    stats = {"chunks": 0, "stored": 0, "source_files": set(), "extra_sources": extra_sources}
+    
+    def enrich_unique(chunks_iter: Iterable[Document]) -> Iterator[Document]:
+        """Assign content-addressed IDs and drop duplicates, recording their sources"""
+        for doc in chunks_iter:
+            stats["chunks"] += 1
+            source_url = doc.metadata.get('source_url', '')
+            stats["source_files"].add(doc.metadata.get('source_file'))
+            chunk_hash = content_hash(doc.page_content)
+            chunk_id = make_chunk_id(source_url, chunk_hash)
+            
+            if dedup is not None:
+                duplicate_of = dedup.find_duplicate(
+                    chunk_id, doc.page_content, chunk_hash, dedup_scope(doc.metadata)
+                )
+                if duplicate_of is not None:
+                    extra_sources.setdefault(duplicate_of, set()).add(source_url)
+                    continue
+            
+            doc.metadata['chunk_id'] = chunk_id
+            doc.metadata['content_hash'] = chunk_hash
+            doc.metadata['sources'] = source_url
+            doc.metadata['source_count'] = 1
+            preview = doc.page_content[:200].replace('\n', ' ')
+            doc.metadata['preview'] = preview
+            yield doc
+    
+    for batch in iter_batches(enrich_unique(chunks), batch_size):
+        if not stats["stored"]:
+            print("\nSample chunk metadata:")
+            sample = batch[0]
+            print(f"  Title: {sample.metadata.get('title', 'N/A')}")
+            print(f"  Type: {sample.metadata.get('type', 'N/A')}")
+            print(f"  Category: {sample.metadata.get('category', 'N/A')}")
+            print(f"  Date: {sample.metadata.get('date', 'N/A')}")
+            print(f"  Content preview: {sample.page_content[:150]}...\n")
+        
+        vector_store.add_documents(batch, ids=[doc.metadata['chunk_id'] for doc in batch])
+        stats["stored"] += len(batch)
+        print(f"  Embedded and persisted {stats['stored']} chunks...")
+    
+    if extra_sources:
+        print(f"Recording additional sources for {len(extra_sources)} shared chunks...")
+        merge_chunk_sources(vector_store, extra_sources, batch_size)
+    
+    total_documents = len(stats["source_files"])
+    print(f"\nSuccessfully vectorized and persisted {stats['stored']} document chunks!")
+    print(f"Statistics:")
+    print(f"   - Total documents: {total_documents}")
+    print(f"   - Total chunks: {stats['chunks']}")
+    print(f"   - Unique chunks embedded: {stats['stored']}")
+    if dedup is not None:
+        print(f"   - Exact duplicates skipped: {dedup.exact_duplicates}")
+        print(f"   - Near duplicates skipped: {dedup.near_duplicates}")
+    if total_documents:
+        print(f"   - Avg chunks per document: {stats['chunks']/total_documents:.1f}")
+    
+    return stats
+
+
+def validate_index(vector_store: Chroma, expected_chunks: int) -> bool:
+    """Smoke test a freshly built index before it is published"""
+    try:
+        count = vector_store._collection.count()
+        results = vector_store.similarity_search("Institut Obert de Catalunya", k=1)
+    except Exception as e:
+        print(f"Index validation failed: {str(e)}")
+        return False
+    
+    if count != expected_chunks:
+        print(f"Index validation failed: expected {expected_chunks} chunks, found {count}")
+        return False
+    return len(results) > 0
+
+
+def load_eval_questions(
+    eval_file: Optional[str],
+    data_folder: str,
+    sample_size: int = 50,
+    corpus_path: Optional[str] = None,
+) -> List[dict]:
+    """
+    Load retrieval evaluation questions
+    
+    The eval file is JSONL with {"question": ..., "expected_sources": [url, ...]} per line.
+    Without one, document titles are used as queries and their own URL as the
+    expected source, which gives a rough recall proxy.
+    """
+    if eval_file:
+        with open(eval_file, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    
+    questions = []
+    for doc in iter_documents(data_folder, corpus_path=corpus_path):
+        title = doc.metadata.get('title', '')
+        if title and title not in ('Sense títol', 'No title'):
+            questions.append({"question": title, "expected_sources": [doc.metadata['source_url']]})
+            if len(questions) >= sample_size:
+                break
+    return questions
+
+
+def evaluate_chunking_profiles(
+    profiles: dict,
+    data_folder: str = "./data",
+    embedding_model: str = "nomic-embed-text",
+    eval_file: Optional[str] = None,
+    k: int = 4,
+    batch_size: int = 256,
+    workers: Optional[int] = None,
+    corpus_path: Optional[str] = None,
+) -> List[dict]:
+    """
+    Offline comparison of chunking profiles. Each profile is indexed into a temporary
+    directory and reported with chunk count, index size, embed time and recall@k.
+    
+    Args:
+        profiles: Mapping of profile name to {"chunk_size", "chunk_overlap", and optional
+            per-type overrides under "types"}
+        data_folder: Path to folder containing documents
+        embedding_model: Name of embedding model
+        eval_file: Optional JSONL file of questions with expected source URLs
+        k: Number of results considered for recall
+        batch_size: Number of chunks embedded per batch
+        workers: Loader/tokenizer processes
+        corpus_path: Corpus store read instead of data_folder when it has pages
+    
+    Returns:
+        One report dict per profile
+    """
+    embeddings = create_embeddings(embedding_model)
+    questions = load_eval_questions(eval_file, data_folder, corpus_path=corpus_path)
+    print(f"Evaluating {len(profiles)} chunking profiles on {len(questions)} questions (recall@{k})")
+    
+    reports = []
+    for name, profile in profiles.items():
+        index_dir = tempfile.mkdtemp(prefix=f"chunk_eval_{name}_")
+        try:
+            vector_store = Chroma(
+                collection_name="chunk_eval",
+                embedding_function=embeddings,
+                persist_directory=index_dir,
+                collection_configuration=hnsw_configuration_from_env(),
+            )
+            chunks = iter_chunks(
+                data_folder,
+                chunk_size=profile.get("chunk_size", 800),
+                chunk_overlap=profile.get("chunk_overlap", 150),
+                workers=workers,
+                profiles=profile.get("types"),
+                corpus_path=corpus_path,
+            )
+            start = time.perf_counter()
+            stats = build_index(vector_store, chunks, batch_size)
+            embed_time = time.perf_counter() - start
+            
+            hits = 0
+            for item in questions:
+                expected = set(item.get("expected_sources", []))
+                for doc in vector_store.similarity_search(item["question"], k=k):
+                    sources = set((doc.metadata.get('sources') or '').split('|'))
+                    sources.add(doc.metadata.get('source_url'))
+                    if expected & sources:
+                        hits += 1
+                        break
+            
+            reports.append({
+                "profile": name,
+                "chunks": stats["stored"],
+                "index_bytes": directory_size(index_dir),
+                "embed_seconds": round(embed_time, 2),
+                "recall_at_k": round(hits / len(questions), 3) if questions else None,
+            })
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+    
+    print("\nChunking profile evaluation:")
+    for report in reports:
+        print(
+            f"   - {report['profile']}: {report['chunks']} chunks, "
+            f"{report['index_bytes'] / 1_048_576:.1f} MiB, "
+            f"embed {report['embed_seconds']}s, recall@{k} {report['recall_at_k']}"
+        )
+    return reports
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorize crawled documents into ChromaDB")
+    parser.add_argument(
+        "--evaluate",
+        metavar="PROFILES_JSON",
+        help="Compare chunking profiles offline instead of publishing an index "
+             "(JSON file mapping profile name to chunk_size/chunk_overlap/types)",
+    )
+    parser.add_argument("--eval-file", help="JSONL questions with expected_sources for --evaluate")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-embed corpus pages changed since the live index was built",
+    )
+    args = parser.parse_args()
+    
     embedding_model = os.getenv("EMBEDDING_MODEL")
     
     if not embedding_model:
-        if PROVIDER == "openai":
+        if EMBEDDING_PROVIDER == "local":
+            embedding_model = DEFAULT_LOCAL_EMBEDDING_MODEL
+        elif EMBEDDING_PROVIDER == "openai":
             embedding_model = "text-embedding-3-small"
         else:
             embedding_model = "nomic-embed-text"
     
-    print(f"Using provider: {PROVIDER}")
+    print(f"Using provider: {EMBEDDING_PROVIDER}")
     print(f"Using embedding model: {embedding_model}")
     
-    vectorize_and_persist(embedding_model=embedding_model)
-
+    if args.evaluate:
+        with open(args.evaluate, 'r', encoding='utf-8') as f:
+            eval_profiles = json.load(f)
+        evaluate_chunking_profiles(
+            eval_profiles,
+            embedding_model=embedding_model,
+            eval_file=args.eval_file,
+            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "256")),
+            corpus_path=os.getenv("CORPUS_PATH", "./corpus.db"),
+        )
+    elif args.incremental:
+        profiles_env = os.getenv("CHUNKING_PROFILES")
+        result = refresh_index(
+            os.getenv("CORPUS_PATH", "./corpus.db"),
+            persist_directory=os.getenv("CHROMA_DB_PATH", "./chroma_db"),
+            collection_name=os.getenv("COLLECTION_NAME", "ioc_data"),
+            embedding_model=embedding_model,
+            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "256")),
+            chunk_size=int(os.getenv("CHUNK_SIZE", "800")),
+            chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "150")),
+            workers=int(os.getenv("VECTORIZE_WORKERS", "0")) or None,
+            chunking_profiles=json.loads(profiles_env) if profiles_env else None,
+            data_folder=os.getenv("DATA_PATH", "./data"),
+        )
+        if result is None:
+            sys.exit(1)
+    else:
+        profiles_env = os.getenv("CHUNKING_PROFILES")
+        vectorize_and_persist(
+            data_folder=os.getenv("DATA_PATH", "./data"),
+            persist_directory=os.getenv("CHROMA_DB_PATH", "./chroma_db"),
+            collection_name=os.getenv("COLLECTION_NAME", "ioc_data"),
+            embedding_model=embedding_model,
+            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "256")),
+            chunk_size=int(os.getenv("CHUNK_SIZE", "800")),
+            chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "150")),
+            workers=int(os.getenv("VECTORIZE_WORKERS", "0")) or None,
+            chunking_profiles=json.loads(profiles_env) if profiles_env else None,
+            corpus_path=os.getenv("CORPUS_PATH", "./corpus.db"),
+        )